@@ -1,7 +1,11 @@
+import base64
 import collections
 import functools
 import itertools
+import math
 import re
+import threading
+import time
 from typing import Any
 from typing import Callable
 from typing import Iterable
@@ -10,28 +14,58 @@ from typing import Mapping
 from typing import MutableMapping
 from typing import Optional
 
+from java.io import StringReader
+from java.lang import Double
+from java.lang import Float
 from java.lang import IllegalArgumentException
+from java.lang import Integer
+from java.lang import Long
+from java.lang import Number
+from java.util import Arrays
 from java.util import HashMap
+from java.util import HashSet
+from lucene import InvalidArgsError
+from lucene import JArray
 from lucene import JavaError
 from lupyne.engine import Analyzer
 from lupyne.engine import Query
-from lupyne.engine.documents import Hit
 from lupyne.engine.documents import Hits
+from lupyne.engine.indexers import IndexSearcher
 from lupyne.engine.utils import Atomic
+from org.apache.lucene.analysis import TokenStream
 from org.apache.lucene.analysis.core import LowerCaseFilter
+from org.apache.lucene.analysis.core import WhitespaceTokenizer
 from org.apache.lucene.analysis.miscellaneous import WordDelimiterGraphFilterFactory
+from org.apache.lucene.analysis.tokenattributes import CharTermAttribute
 from org.apache.lucene.document import Document
+from org.apache.lucene.facet import FacetsCollector
+from org.apache.lucene.facet import LongValueFacetCounts
+from org.apache.lucene.facet import StringDocValuesReaderState
+from org.apache.lucene.facet import StringValueFacetCounts
+from org.apache.lucene.index import DocValuesType
+from org.apache.lucene.index import MultiDocValues
+from org.apache.lucene.index import StoredFields
 from org.apache.lucene.queryparser.classic import ParseException
 from org.apache.lucene.queryparser.flexible.standard import QueryParserUtil
 from org.apache.lucene.search import BooleanQuery
+from org.apache.lucene.search import DocIdSetIterator
+from org.apache.lucene.search import FieldDoc
+from org.apache.lucene.search import QueryVisitor
+from org.apache.lucene.search import ScoreDoc
 from org.apache.lucene.search import SortField
+from org.apache.lucene.search import SortedNumericSortField
+from org.apache.lucene.search import SortedSetSortField
+from org.apache.lucene.util import BytesRef
 
+import metrics
+from cache import LRUCache
 from common import json
 from common import logger
 from core import AnalyzerEX
 from core import FieldEX
 from core import IndexerEX
 from core import PythonComplexPhraseQueryParserEX
+from processing import ResourceProcessor
 
 
 class ResourceAnalyzer(AnalyzerEX):
@@ -66,37 +100,130 @@ class ResourcePythonComplexPhraseQueryParser(PythonComplexPhraseQueryParserEX):
     get_numeric = int
 
 
-class ResourceIndexer(IndexerEX):
-    FIELD_RAW = "_raw_"
+class ResourceSchema:
+    def __init__(self, stored_field: str):
+        self.stored_field = stored_field
+        self.fields = {}
+        self.numeric_fields = set()
+        self.numeric_like_fields = {}
+        self.keyword_fields = {}
+        self.ngram_fields = {}
+
+    def set(self, name: str, cls: type = FieldEX, **settings) -> FieldEX:
+        field = self.fields[name] = cls(name, **settings)
+        return field
+
+    def set_text(self, field: str, group: bool = False) -> FieldEX:
+        return self.set(
+            field,
+            FieldEX.SortableTextGroup if group else FieldEX.SortableText,
+            stored=field == self.stored_field,
+        )
+
+    def set_raw(self, field: str) -> FieldEX:
+        return self.set(field, FieldEX, stored=True)
+
+    def set_numeric(self, field: str, group: bool = False) -> FieldEX:
+        if field not in self.numeric_like_fields:
+            self.numeric_fields.add(field)
+        return self.set(
+            field,
+            FieldEX.SortableNumericGroup if group else FieldEX.SortableNumeric,
+            stored=field == self.stored_field,
+        )
+
+    def set_numeric_like(self, field: str, group: bool = False) -> FieldEX:
+        numeric_like_field = self.get_numeric_like_field(field)
+        self.numeric_like_fields[field] = numeric_like_field
+        self.set_text(numeric_like_field, group)
+        return self.set_numeric(field, group)
+
+    get_numeric_like_field = "_{}_".format
+
+    def set_keyword(self, field: str) -> FieldEX:
+        keyword_field = self.get_keyword_field(field)
+        self.keyword_fields[field] = keyword_field
+        return self.set(keyword_field, FieldEX.String)
+
+    get_keyword_field = "!{}".format
+
+    def set_ngram(self, field: str) -> FieldEX:
+        ngram_field = self.get_ngram_field(field)
+        self.ngram_fields[field] = ngram_field
+        return self.set(ngram_field, FieldEX.Text, omitNorms=True)
+
+    get_ngram_field = "#{}".format
+
+
+class ResourceIndexer(ResourceProcessor, IndexerEX):
     FIELD_DEFAULT = "name"
     FIELD_STORED = "id"
 
     _NEGATOR = "-"
     _DELIMITER = ","
-    _SEPARATOR = "."
-    _SEPARATOR_ESCAPED = re.escape(_SEPARATOR)
+    _EXACT = re.compile(r"(?<![\w\\])!([\w.]+):")
     _FIELD_VALUE_MAPS = collections.defaultdict(lambda: str.lower)
+    _RAW_FIELDS = HashSet(Arrays.asList([ResourceProcessor.FIELD_RAW]))
+    _SORT_VALUE_TYPES = {
+        "BytesRef": BytesRef,
+        "Long": Long.valueOf,
+        "Integer": Integer.valueOf,
+        "Double": Double.valueOf,
+        "Float": Float.valueOf,
+    }
+    _SORT_VALUE_CHECKS = {
+        "BytesRef": lambda value: isinstance(value, str),
+        "Long": lambda value: type(value) is int and -(2**63) <= value < 2**63,
+        "Integer": lambda value: type(value) is int and -(2**31) <= value < 2**31,
+        "Double": lambda value: type(value) in (int, float),
+        "Float": lambda value: type(value) in (int, float),
+    }
+    _SORT_FIELD_VALUE_TYPES = {
+        "STRING": "BytesRef",
+        "LONG": "Long",
+        "INT": "Integer",
+        "DOUBLE": "Double",
+        "FLOAT": "Float",
+    }
+    _RESULT_ENTRY_SIZE = 32
 
-    def __init__(self, directory: str, mode: str = "a"):
+    def __init__(
+        self,
+        directory: str,
+        mode: str = "a",
+        *,
+        document_cache_size: Optional[int] = None,
+        result_cache_size: Optional[int] = None,
+        result_cache_bytes: Optional[int] = None,
+        query_cache_size: Optional[int] = None,
+        ngram_fields: Iterable[str] = (),
+        ngram_size: int = 3,
+        **attrs,
+    ):
         analyzer = ResourceAnalyzer.resource()
-        super().__init__(directory, mode, analyzer)
+        super().__init__(directory, mode, analyzer, **attrs)
         self.shared.add(analyzer)
-        self.numeric_fields = set()
-        self.numeric_like_fields = {}
+        self.ngram_field_names = {*ngram_fields}
+        self.ngram_size = ngram_size
         self.parser = functools.partial(
             ResourcePythonComplexPhraseQueryParser,
-            numeric_fields=self.numeric_fields,
-            numeric_like_fields=self.numeric_like_fields,
+            ngram_size=ngram_size,
             field_value_maps=self._FIELD_VALUE_MAPS,
             allow_leading_wildcard=True,
         )
-        self.indices = tuple(self[index][self.FIELD_STORED] for index in self)
+        self._parsers = threading.local()
+        self._indices = None
+        self._facet_states = {}
+        self.document_cache = LRUCache(maxbytes=document_cache_size)
+        self.result_cache = LRUCache(result_cache_size, result_cache_bytes)
+        self.query_cache = LRUCache(query_cache_size)
+        self.set_schema(ResourceSchema(self.FIELD_STORED))
 
     def __getitem__(self, index):
         if isinstance(index, str):
             try:
-                index = self.indices.index(index)
-            except ValueError:
+                index = self.indices[index]
+            except KeyError:
                 raise IndexError
         try:
             return super().__getitem__(index)
@@ -107,6 +234,75 @@ class ResourceIndexer(IndexerEX):
             else:
                 raise
 
+    def clear_caches(self):
+        self._facet_states.clear()
+        self.query_cache.clear()
+        self.result_cache.clear()
+        self.document_cache.clear()
+
+    def set_schema(self, schema: ResourceSchema):
+        # requests read these registries concurrently, so they are replaced, never
+        # mutated, and fields goes first as the others only name fields it holds
+        self.fields = schema.fields
+        self.numeric_fields = schema.numeric_fields
+        self.numeric_like_fields = schema.numeric_like_fields
+        self.keyword_fields = schema.keyword_fields
+        self.ngram_fields = schema.ngram_fields
+        self._schema = schema
+        self.query_cache.clear()
+
+    def reopen(self) -> bool:
+        searcher = self.indexSearcher
+        reopened = self.reopen_searcher()
+        if reopened is searcher:
+            return False
+        self.indexSearcher = reopened
+        self.clear_caches()
+        logger.debug("reopen%s", {"generation": reopened.version})
+        return True
+
+    @property
+    def indices(self) -> dict[str, int]:
+        return self.get_indices(self.indexSearcher)
+
+    def get_indices(self, searcher: IndexSearcher) -> dict[str, int]:
+        generation = searcher.version
+        indices = self._indices
+        if indices is None or indices[0] != generation:
+            indices = self._indices = generation, self._load_indices(searcher)
+        return indices[1]
+
+    def set_indices(self, searcher: IndexSearcher, indices: dict[str, int]):
+        self._indices = searcher.version, indices
+
+    def _load_indices(self, searcher: IndexSearcher) -> dict[str, int]:
+        docvalues = MultiDocValues.getSortedValues(
+            searcher.indexReader, self.FIELD_STORED
+        )
+        if docvalues is None:
+            return {
+                str(searcher[index][self.FIELD_STORED]): index for index in searcher
+            }
+        indices = {}
+        bits = searcher.bits
+        for index in iter(docvalues.nextDoc, DocIdSetIterator.NO_MORE_DOCS):
+            if not bits or bits.get(index):
+                value = docvalues.lookupOrd(docvalues.ordValue())
+                indices[value.utf8ToString()] = index
+        logger.debug("_load_indices%s", {"generation": searcher.version})
+        return indices
+
+    def lookup(self, index: int | str) -> Hits:
+        searcher = self.indexSearcher
+        if isinstance(index, str):
+            try:
+                index = self.get_indices(searcher)[index]
+            except KeyError:
+                raise IndexError
+        elif index not in searcher:
+            raise IndexError
+        return Hits(searcher, [ScoreDoc(index, float("nan"))], 1)
+
     @staticmethod
     def _patch_negative_query(query: Query):
         if BooleanQuery.instance_(query):
@@ -125,6 +321,10 @@ class ResourceIndexer(IndexerEX):
             is_numeric_like_field = name in self.numeric_like_fields
             if isinstance(texts, Atomic):
                 texts = (texts,)
+            if name in self.keyword_fields:
+                items[self.keyword_fields[name]] = [str(text).lower() for text in texts]
+            if name in self.ngram_fields:
+                items[self.ngram_fields[name]] = self._get_ngram_stream(name, texts)
             field_texts = []
             numeric_like_field_texts = []
             for text in texts:
@@ -145,91 +345,147 @@ class ResourceIndexer(IndexerEX):
             items[name] = field_texts
         return super().document(items)
 
+    def _iter_terms(self, field: str, text: str) -> Iterator[str]:
+        stream = self.analyzer.tokenStream(field, text)
+        term = CharTermAttribute.cast_(stream.addAttribute(CharTermAttribute.class_))
+        stream.reset()
+        try:
+            while stream.incrementToken():
+                yield term.toString()
+            stream.end()
+        finally:
+            stream.close()
+
+    def _get_ngram_stream(self, field: str, texts: Iterable[Any]) -> TokenStream:
+        ngrams = []
+        for text in texts:
+            for term in list(self._iter_terms(field, str(text))):
+                ngrams += ResourcePythonComplexPhraseQueryParser.get_ngrams(
+                    ResourcePythonComplexPhraseQueryParser.NGRAM_START
+                    + term
+                    + ResourcePythonComplexPhraseQueryParser.NGRAM_END,
+                    self.ngram_size,
+                )
+        tokenizer = WhitespaceTokenizer()
+        tokenizer.setReader(StringReader(" ".join(ngrams)))
+        return tokenizer
+
+    def _get_parser(self) -> ResourcePythonComplexPhraseQueryParser:
+        schema = self._schema
+        try:
+            parser_schema, parser = self._parsers.parser
+        except AttributeError:
+            pass
+        else:
+            if parser_schema is schema:
+                return parser
+            # the Python/Java reference cycle keeps extension objects and the
+            # registries they point to alive until finalize() breaks it
+            parser.finalize()
+        parser = self.parser(
+            "",
+            self.analyzer,
+            numeric_fields=schema.numeric_fields,
+            numeric_like_fields=schema.numeric_like_fields,
+            keyword_fields=schema.keyword_fields,
+            ngram_fields=schema.ngram_fields,
+        )
+        self._parsers.parser = schema, parser
+        return parser
+
     # noinspection PyMethodOverriding
     def parse(self, query: str) -> Query:
-        return self._patch_negative_query(super().parse(query))
+        return self._patch_negative_query(self._get_parser().parse(query))
 
     def search(
-        self, query: Optional[str] = None, sort: Optional[str | Iterable[str]] = None
+        self,
+        query: Optional[str] = None,
+        sort: Optional[str | Iterable[str]] = None,
+        count: Optional[int] = None,
+        mincount: Optional[int] = None,
+        timeout: Optional[int] = None,
+        after: Optional[ScoreDoc] = None,
+    ) -> Hits:
+        searcher = self.indexSearcher
+        if query is not None:
+            query = query.strip()
+        if mincount is None:
+            mincount = Integer.MAX_VALUE
+        if after is not None:
+            return self._search(searcher, query, sort, count, mincount, timeout, after)
+        key = searcher.version, query, tuple(self.get_sort_key(sort)), mincount
+        hits = self.result_cache.get(key)
+        if hits is not None and (
+            len(hits) == hits.count or (count is not None and len(hits) >= count)
+        ):
+            logger.debug("search%s", {"result_cache": self.result_cache.get_stats()})
+            return hits if count is None else hits[:count]
+        start = time.perf_counter()
+        hits = self._search(searcher, query, sort, count, mincount, timeout)
+        if timeout is None or time.perf_counter() - start < timeout:
+            size = len(hits) * self._RESULT_ENTRY_SIZE * (1 + len(key[2]))
+            self.result_cache.set(key, hits, size)
+        return hits
+
+    def _search(
+        self,
+        searcher: IndexSearcher,
+        query: Optional[str],
+        sort: Optional[str | Iterable[str]],
+        count: Optional[int],
+        mincount: int,
+        timeout: Optional[int],
+        after: Optional[ScoreDoc] = None,
     ) -> Hits:
         if query is not None:
             query = self.get_query(query)
         if sort is not None:
             sort = self.get_sort(sort)
-        return self.indexSearcher.search(query, sort=sort)
-
-    def set_text(self, field: str, group: bool = False) -> FieldEX:
-        return self.set(
-            field,
-            FieldEX.SortableTextGroup if group else FieldEX.SortableText,
-            stored=field == self.FIELD_STORED,
-        )
-
-    def set_numeric(self, field: str, group: bool = False) -> FieldEX:
-        if field not in self.numeric_like_fields:
-            self.numeric_fields.add(field)
-        return self.set(
-            field,
-            FieldEX.SortableNumericGroup if group else FieldEX.SortableNumeric,
-            stored=field == self.FIELD_STORED,
-        )
+        with metrics.phase("search"):
+            return searcher.search(
+                query,
+                count=count,
+                sort=sort,
+                mincount=mincount,
+                timeout=timeout,
+                after=after,
+            )
 
-    def set_numeric_like(self, field: str, group: bool = False) -> FieldEX:
-        numeric_like_field = self.get_numeric_like_field(field)
-        self.numeric_like_fields[field] = numeric_like_field
-        self.set_text(numeric_like_field, group)
-        return self.set_numeric(field, group)
+    def _get_raw(self, stored_fields: StoredFields, index: int) -> str:
+        return stored_fields.document(index, self._RAW_FIELDS).get(self.FIELD_RAW)
 
-    get_numeric_like_field = "_{}_".format
+    def _get_raw_fields(self, selects: tuple[set[str], set[str]]) -> Optional[HashSet]:
+        names = {name for name in self.fields if name.startswith(self._RAW_PREFIX)}
+        if not names:
+            return None
+        include, exclude = selects
+        if include:
+            names &= set(map(self.get_raw_field, include))
+        names -= set(map(self.get_raw_field, exclude))
+        raw_fields = HashSet()
+        for name in names:
+            raw_fields.add(name)
+        return raw_fields
 
-    def _flatten(self, obj, root: MutableMapping[str, Any], __parent: str = "") -> Any:
-        if isinstance(obj, (str, int, float, bool)):
-            return obj
-        elif isinstance(obj, Iterable):
-            if __parent:
-                __parent += self._SEPARATOR
-            for key, val in obj.items() if isinstance(obj, dict) else enumerate(obj):
-                parent = f"{__parent}{key}"
-                children = {}
-                flattened = self._flatten(val, children, parent)
-                if flattened is children:
-                    root.update(children)
-                else:
-                    root[parent] = flattened
-            return root
-
-    def _merge(self, obj: Mapping[str, Any]) -> dict[str, Any]:
-        merged = {}
-        non_digit_keys = set()
-        for key in obj.keys():
-            parts = key.split(self._SEPARATOR)
-            non_digit_parts = [
-                part for part in key.split(self._SEPARATOR) if not part.isdigit()
-            ]
-            non_digit_key = self._SEPARATOR.join(non_digit_parts)
-            if parts == non_digit_parts:
-                merged[key] = obj[key]
-            elif non_digit_key not in non_digit_keys:
-                pattern = re.compile(
-                    rf"{self._SEPARATOR_ESCAPED}\d+{self._SEPARATOR_ESCAPED}".join(
-                        map(re.escape, non_digit_parts)
-                    )
-                    + rf"(?:{self._SEPARATOR_ESCAPED}\d+)?"
-                )
-                merged[non_digit_key] = [
-                    val for key_, val in obj.items() if pattern.fullmatch(key_)
-                ]
-                non_digit_keys.add(non_digit_key)
-        return merged
-
-    def process(self, items: Mapping[str, Any]) -> dict[str, Any]:
-        processed = self._merge(self._flatten(items, {}))
-        processed[self.FIELD_RAW] = json.dumps(items, separators=(",", ":"))
-        return processed
+    def _get_raw_selected(
+        self, stored_fields: StoredFields, index: int, raw_fields: HashSet
+    ) -> str:
+        fragments = (
+            f"{json.dumps(field.name().removeprefix(self._RAW_PREFIX))}:"
+            f"{field.stringValue()}"
+            for field in stored_fields.document(index, raw_fields).iterator()
+        )
+        return "{" + ",".join(fragments) + "}"
 
-    @functools.cache
-    def _load(self, obj: str) -> dict[str, Any]:
-        return json.loads(obj)
+    def _load(self, searcher: IndexSearcher, index: int) -> dict[str, Any]:
+        key = searcher.version, index
+        items = self.document_cache.get(key)
+        if items is None:
+            obj = self._get_raw(searcher.storedFields(), index)
+            with metrics.phase("decode"):
+                items = json.loads(obj)
+            self.document_cache.set(key, items, len(obj))
+        return items
 
     @classmethod
     def _select(
@@ -242,18 +498,36 @@ class ResourceIndexer(IndexerEX):
 
     def unprocess(
         self,
-        hit: Mapping[str, Any],
+        searcher: IndexSearcher,
+        index: int,
         selects: Optional[tuple[set[str], set[str]]] = None,
-    ):
-        items = self._load(hit[self.FIELD_RAW])
+    ) -> Mapping[str, Any]:
+        items = self._load(searcher, index)
         if selects:
             items = self._select(items, selects)
         return items
 
     def get_query(self, query: str) -> Query:
-        # TODO https://docs.pokemontcg.io/api-reference/cards/search-cards#exact-matching
         query = query.strip()
+        parsed = self.query_cache.get(query)
+        if parsed is None:
+            with metrics.phase("parse"):
+                parsed = self._get_query(query)
+            self.query_cache.set(query, parsed)
+        return parsed
+
+    def _replace_exact(self, match: re.Match) -> str:
+        field = match[1]
+        try:
+            keyword_field = self.keyword_fields[field]
+        except KeyError:
+            return f"{field}:"
+        return f"{QueryParserUtil.escape(keyword_field)}:"
+
+    def _get_query(self, query: str) -> Query:
         if ":" in query:
+            # https://docs.pokemontcg.io/api-reference/cards/search-cards#exact-matching
+            query = self._EXACT.sub(self._replace_exact, query)
             try:
                 query = self.parse(query)
             except JavaError as exc:
@@ -261,8 +535,16 @@ class ResourceIndexer(IndexerEX):
                 if not ParseException.instance_(java_exc):
                     logger.error("get_query%s", {"except": exc}, exc_info=exc)
                 query = Query.nodocs()
+        elif (
+            query
+            and self.FIELD_DEFAULT in self.ngram_fields
+            and query.split() == [query]
+        ):
+            query = self._get_query(
+                f"{self.FIELD_DEFAULT}:{QueryParserUtil.escape(query)}*"
+            )
         elif query:
-            query = self.get_query(
+            query = self._get_query(
                 f'{self.FIELD_DEFAULT}:"{QueryParserUtil.escape(query) + "*"}"'
             )
         else:
@@ -270,6 +552,26 @@ class ResourceIndexer(IndexerEX):
         logger.debug("get_query%s", {"return": query})
         return query
 
+    def describe_query(
+        self,
+        query: Optional[str],
+        hits: Optional[Hits] = None,
+        rewrite: bool = False,
+        explain: bool = False,
+    ) -> dict[str, Any]:
+        parsed = self.get_query("" if query is None else query)
+        searcher = self.indexSearcher if hits is None else hits.searcher
+        description = {"query": parsed.toString()}
+        if rewrite:
+            terms = HashSet()
+            searcher.rewrite(parsed).visit(QueryVisitor.termCollector(terms))
+            description["terms"] = terms.size()
+        if explain and hits is not None and len(hits):
+            description["explain"] = searcher.explain(
+                parsed, hits.scoredocs[0].doc
+            ).toString()
+        return description
+
     def get_sort(self, sorts: str | Iterable[str]) -> Optional[list[SortField]]:
         sort_fields = []
         if isinstance(sorts, str):
@@ -279,7 +581,7 @@ class ResourceIndexer(IndexerEX):
         ):
             field = part.strip().replace(" ", "")
             name = field.removeprefix(self._NEGATOR)
-            if name in self.fields:
+            if name in self.fields and self.fields[name].docvalues:
                 sort_fields.append(
                     self.sortfield(name, reverse=field.startswith(self._NEGATOR))
                 )
@@ -287,6 +589,216 @@ class ResourceIndexer(IndexerEX):
         if sort_fields:
             return sort_fields
 
+    def get_sort_key(self, sorts: Optional[str | Iterable[str]]) -> list[str]:
+        if sorts is not None:
+            sorts = self.get_sort(sorts)
+        return [str(sort_field) for sort_field in sorts or ()]
+
+    def get_facet_fields(self, facets: str | Iterable[str]) -> list[str]:
+        facet_fields = []
+        if isinstance(facets, str):
+            facets = (facets,)
+        for part in itertools.chain.from_iterable(
+            facet.split(self._DELIMITER) for facet in facets
+        ):
+            name = part.strip().replace(" ", "")
+            if (
+                name in self.fields
+                and self.fields[name].docvalues
+                and name not in facet_fields
+            ):
+                facet_fields.append(name)
+        logger.debug("get_facet_fields%s", {"return": facet_fields})
+        return facet_fields
+
+    def _get_facet_state(
+        self, searcher: IndexSearcher, field: str
+    ) -> StringDocValuesReaderState:
+        key = searcher.version, field
+        state = self._facet_states.get(key)
+        if state is None:
+            state = self._facet_states[key] = StringDocValuesReaderState(
+                searcher.indexReader, field
+            )
+        return state
+
+    def _count_facet(
+        self, searcher: IndexSearcher, collector: FacetsCollector, field: str
+    ) -> dict[str, int]:
+        field = self.numeric_like_fields.get(field, field)
+        if self.fields[field].docValuesType in (
+            DocValuesType.SORTED,
+            DocValuesType.SORTED_SET,
+        ):
+            counts = StringValueFacetCounts(
+                self._get_facet_state(searcher, field), collector
+            )
+        else:
+            counts = LongValueFacetCounts(field, collector)
+        result = counts.getAllChildren(field, JArray("string")(0))
+        if result is None:
+            return {}
+        label_values = sorted(
+            (
+                (label_value.label, label_value.value.intValue())
+                for label_value in result.labelValues
+            ),
+            key=lambda label_value: -label_value[1],
+        )
+        return dict(label_values)
+
+    def get_facets_collector(self, hits: Hits, query: Optional[str]) -> FacetsCollector:
+        parsed = self.get_query("" if query is None else query)
+        with metrics.phase("collect"):
+            collector = FacetsCollector()
+            FacetsCollector.search(hits.searcher, parsed, 0, collector)
+        return collector
+
+    def get_facets(
+        self, hits: Hits, collector: FacetsCollector, facets: str | Iterable[str]
+    ) -> dict[str, dict[str, int]]:
+        with metrics.phase("facet"):
+            return {
+                field: self._count_facet(hits.searcher, collector, field)
+                for field in self.get_facet_fields(facets)
+            }
+
+    def get_stats_fields(self, stats: str | Iterable[str]) -> list[str]:
+        stats_fields = []
+        if isinstance(stats, str):
+            stats = (stats,)
+        for part in itertools.chain.from_iterable(
+            stat.split(self._DELIMITER) for stat in stats
+        ):
+            name = part.strip().replace(" ", "")
+            if (
+                (name in self.numeric_fields or name in self.numeric_like_fields)
+                and self.fields[name].docvalues
+                and name not in stats_fields
+            ):
+                stats_fields.append(name)
+        logger.debug("get_stats_fields%s", {"return": stats_fields})
+        return stats_fields
+
+    @staticmethod
+    def _get_stat(collector: FacetsCollector, field: str) -> dict[str, Any]:
+        result = LongValueFacetCounts(field, collector).getAllChildren(
+            field, JArray("string")(0)
+        )
+        histogram = {}
+        if result is not None:
+            for label_value in result.labelValues:
+                histogram[label_value.label] = label_value.value.intValue()
+        values = [int(value) for value in histogram]
+        count = sum(histogram.values())
+        total = sum(int(value) * count_ for value, count_ in histogram.items())
+        return {
+            "count": count,
+            "min": min(values, default=None),
+            "max": max(values, default=None),
+            "avg": total / count if count else None,
+            "sum": total,
+            "histogram": histogram,
+        }
+
+    def get_stats(
+        self, collector: FacetsCollector, stats: str | Iterable[str]
+    ) -> dict[str, dict[str, Any]]:
+        with metrics.phase("stats"):
+            return {
+                field: self._get_stat(collector, field)
+                for field in self.get_stats_fields(stats)
+            }
+
+    @staticmethod
+    def _dump_sort_value(value) -> Optional[tuple[str, Any]]:
+        if value is None:
+            return None
+        if BytesRef.instance_(value):
+            return BytesRef.__name__, BytesRef.cast_(value).utf8ToString()
+        number = Number.cast_(value)
+        if Double.instance_(value) or Float.instance_(value):
+            number = number.doubleValue()
+        else:
+            number = number.longValue()
+        return value.getClass().getSimpleName(), number
+
+    def _load_sort_value(self, value: Optional[tuple[str, Any]], type_: Optional[str]):
+        if value is not None:
+            value_type, value = value
+            if value_type != type_ or not self._SORT_VALUE_CHECKS[type_](value):
+                raise ValueError(value)
+            return self._SORT_VALUE_TYPES[type_](value)
+
+    def _get_sort_value_type(self, sort_field: SortField) -> Optional[str]:
+        if SortedSetSortField.instance_(sort_field):
+            return BytesRef.__name__
+        if SortedNumericSortField.instance_(sort_field):
+            sort_type = SortedNumericSortField.cast_(sort_field).getNumericType()
+        else:
+            sort_type = sort_field.getType()
+        return self._SORT_FIELD_VALUE_TYPES.get(sort_type.toString())
+
+    def get_cursor(
+        self, hits: Hits, sorts: Optional[str | Iterable[str]] = None
+    ) -> Optional[str]:
+        if not len(hits):
+            return None
+        score_doc = hits.scoredocs[len(hits) - 1]
+        values = []
+        if FieldDoc.instance_(score_doc):
+            values.extend(map(self._dump_sort_value, FieldDoc.cast_(score_doc).fields))
+        score = None if math.isnan(score_doc.score) else score_doc.score
+        cursor = json.dumps(
+            (
+                hits.searcher.version,
+                self.get_sort_key(sorts),
+                score_doc.doc,
+                score,
+                values,
+            )
+        )
+        return base64.urlsafe_b64encode(cursor.encode()).decode()
+
+    def get_after(
+        self, cursor: str, sorts: Optional[str | Iterable[str]] = None
+    ) -> ScoreDoc:
+        searcher = self.indexSearcher
+        try:
+            generation, sort_key, doc, score, values = json.loads(
+                base64.urlsafe_b64decode(cursor.encode())
+            )
+            if generation != searcher.version or sort_key != self.get_sort_key(sorts):
+                raise ValueError(cursor)
+            if type(doc) is not int or not 0 <= doc < searcher.maxDoc():
+                raise ValueError(cursor)
+            if score is None:
+                score = math.nan
+            elif type(score) not in (int, float):
+                raise ValueError(cursor)
+            if not sort_key:
+                return ScoreDoc(doc, float(score))
+            sort_fields = self.get_sort(sorts)
+            if not isinstance(values, list) or len(values) != len(sort_fields):
+                raise ValueError(cursor)
+            values = JArray("object")(
+                [
+                    self._load_sort_value(value, self._get_sort_value_type(sort_field))
+                    for value, sort_field in zip(values, sort_fields)
+                ]
+            )
+            return FieldDoc(doc, float(score), values)
+        except (
+            KeyError,
+            TypeError,
+            ValueError,
+            OverflowError,
+            InvalidArgsError,
+            JavaError,
+        ) as exc:
+            logger.debug("get_after%s", {"except": exc})
+            raise ValueError(cursor)
+
     def get_select(
         self, selects: str | Iterable[str]
     ) -> Optional[tuple[set[str], set[str]]]:
@@ -309,11 +821,39 @@ class ResourceIndexer(IndexerEX):
 
     def iter_hits(
         self,
-        hits: Iterable[Hit],
+        hits: Hits,
+        select: Optional[str | Iterable[str]] = None,
+        start: int = 0,
+        stop: Optional[int] = None,
+    ) -> Iterator[Mapping[str, Any]]:
+        if select:
+            select = self.get_select(select)
+        return (
+            self.unprocess(hits.searcher, index, select)
+            for index in hits[start:stop].ids
+        )
+
+    def iter_raw_hits(
+        self,
+        hits: Hits,
         select: Optional[str | Iterable[str]] = None,
         start: int = 0,
         stop: Optional[int] = None,
-    ) -> Iterator[dict[str, Any]]:
+    ) -> Iterator[str]:
         if select:
             select = self.get_select(select)
-        return (self.unprocess(hit, select) for hit in hits[start:stop])
+        stored_fields = hits.searcher.storedFields()
+        if not select:
+            return (
+                self._get_raw(stored_fields, index) for index in hits[start:stop].ids
+            )
+        raw_fields = self._get_raw_fields(select)
+        if raw_fields is None:
+            return (
+                json.dumps(self.unprocess(hits.searcher, index, select))
+                for index in hits[start:stop].ids
+            )
+        return (
+            self._get_raw_selected(stored_fields, index, raw_fields)
+            for index in hits[start:stop].ids
+        )
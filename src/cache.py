@@ -0,0 +1,116 @@
+import collections
+import concurrent.futures
+import functools
+import threading
+from typing import Any
+from typing import Callable
+from typing import Hashable
+from typing import Optional
+
+
+class LRUCache:
+    def __init__(self, maxsize: Optional[int] = None, maxbytes: Optional[int] = None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items: collections.OrderedDict[Hashable, tuple[Any, int]] = (
+            collections.OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def _is_full(self) -> bool:
+        return (self.maxsize is not None and len(self._items) > self.maxsize) or (
+            self.maxbytes is not None and self.bytes > self.maxbytes
+        )
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            try:
+                value, _ = self._items[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, size: int = 1):
+        if (self.maxsize is not None and self.maxsize < 1) or (
+            self.maxbytes is not None and self.maxbytes < size
+        ):
+            return
+        with self._lock:
+            try:
+                _, old_size = self._items.pop(key)
+            except KeyError:
+                pass
+            else:
+                self.bytes -= old_size
+            self._items[key] = value, size
+            self.bytes += size
+            while self._is_full():
+                _, (_, old_size) = self._items.popitem(last=False)
+                self.bytes -= old_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.bytes = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def get_stats(self) -> dict[str, int | float]:
+        return {
+            "size": len(self),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hit_rate,
+        }
+
+
+class SingleFlight:
+    def __init__(self):
+        self.calls = 0
+        self.shared = 0
+        self._futures: dict[Hashable, concurrent.futures.Future] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._futures)
+
+    def submit(
+        self,
+        key: Hashable,
+        submit: Callable[..., concurrent.futures.Future],
+        fn: Callable,
+        *args,
+    ) -> concurrent.futures.Future:
+        with self._lock:
+            future = self._futures.get(key)
+            if future is not None:
+                self.shared += 1
+                return future
+            future = self._futures[key] = submit(fn, *args)
+            self.calls += 1
+        future.add_done_callback(functools.partial(self._done, key))
+        return future
+
+    def _done(self, key: Hashable, future: concurrent.futures.Future):
+        with self._lock:
+            if self._futures.get(key) is future:
+                del self._futures[key]
+
+    def get_stats(self) -> dict[str, int]:
+        return {"size": len(self), "calls": self.calls, "shared": self.shared}
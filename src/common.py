@@ -1,6 +1,11 @@
 import logging
+import logging.handlers
+import time
+from typing import Any
+from typing import Mapping
 
 import lucene
+from fastapi.responses import Response
 
 import config
 
@@ -20,8 +25,43 @@ except ImportError:
 else:
     from fastapi.responses import ORJSONResponse as JSONResponse
 
+
+class RawJSONResponse(Response):
+    media_type = "application/json"
+
+
+def dumps_raw(obj: Mapping[str, Any], **raws: str) -> str:
+    items = [f"{json.dumps(key)}:{raw}" for key, raw in raws.items()]
+    items.extend(f"{json.dumps(key)}:{json.dumps(val)}" for key, val in obj.items())
+    return "{" + ",".join(items) + "}"
+
+
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=config.LOGGING_LEVEL)
 
+slow_query_logger = logging.getLogger("slow_query")
+slow_query_logger.propagate = False
+if config.SLOW_QUERY_THRESHOLD is not None:
+    slow_query_logger.setLevel(logging.INFO)
+    slow_query_logger.addHandler(
+        logging.handlers.RotatingFileHandler(
+            config.SLOW_QUERY_LOG,
+            maxBytes=config.SLOW_QUERY_LOG_BYTES,
+            backupCount=config.SLOW_QUERY_LOG_BACKUPS,
+        )
+    )
+
+_vm_args = {}
+if config.JVM_INITIAL_HEAP is not None:
+    _vm_args["initialheap"] = config.JVM_INITIAL_HEAP
+if config.JVM_MAX_HEAP is not None:
+    _vm_args["maxheap"] = config.JVM_MAX_HEAP
+_start = time.perf_counter()
 # noinspection PyUnresolvedReferences
-assert lucene.getVMEnv() or lucene.initVM()
+assert lucene.getVMEnv() or lucene.initVM(**_vm_args)
+logger.info("initVM%s", {"seconds": time.perf_counter() - _start})
+
+
+def attach_current_thread():
+    # noinspection PyUnresolvedReferences
+    lucene.getVMEnv().attachCurrentThread()
@@ -4,17 +4,77 @@ from typing import Optional
 
 LOGGING_LEVEL: Final[str] = os.getenv("LOGGING_LEVEL", "INFO").upper()
 
+JVM_INITIAL_HEAP: Final[Optional[str]] = os.getenv("JVM_INITIAL_HEAP")
+JVM_MAX_HEAP: Final[Optional[str]] = os.getenv("JVM_MAX_HEAP")
+
 FASTAPI_DEBUG: Final[bool] = os.getenv("FASTAPI_DEBUG", "false").lower() == "true"
+WEB_CONCURRENCY: Final[int] = int(os.getenv("WEB_CONCURRENCY", 1))
 
 LUCENE_COUNT: Final[Optional[int]] = int(os.getenv("LUCENE_COUNT", "0")) or None
+LUCENE_MIN_COUNT: Final[Optional[int]] = int(os.getenv("LUCENE_MIN_COUNT", "0")) or None
 LUCENE_TIMEOUT: Final[Optional[int]] = int(os.getenv("LUCENE_TIMEOUT", "0")) or None
+LUCENE_DIRECTORY: Final[str] = os.getenv("LUCENE_DIRECTORY", "mmap").lower()
+LUCENE_WARM: Final[bool] = os.getenv("LUCENE_WARM", "false").lower() == "true"
+LUCENE_WORKERS: Final[int] = int(os.getenv("LUCENE_WORKERS", os.cpu_count() or 1))
+LUCENE_QUEUE_SIZE: Final[int] = int(os.getenv("LUCENE_QUEUE_SIZE", 256))
 
 DATA_DIRECTORY: Final[str] = os.getenv("DATA_DIRECTORY", "data")
 INDEX_DIRECTORY: Final[str] = os.getenv("INDEX_DIRECTORY", "index")
+INDEX_WORKERS: Final[int] = int(os.getenv("INDEX_WORKERS", os.cpu_count() or 1))
+INDEX_BATCH_SIZE: Final[int] = int(os.getenv("INDEX_BATCH_SIZE", 512))
+INDEX_OPTIMIZE: Final[bool] = os.getenv("INDEX_OPTIMIZE", "true").lower() == "true"
+INDEX_BEST_COMPRESSION: Final[bool] = (
+    os.getenv("INDEX_BEST_COMPRESSION", "false").lower() == "true"
+)
+INDEX_INCREMENTAL: Final[bool] = (
+    os.getenv("INDEX_INCREMENTAL", "false").lower() == "true"
+)
+NGRAM_FIELDS: Final[list[str]] = [
+    field
+    for field in os.getenv("NGRAM_FIELDS", "name,attacks.name,abilities.name").split(
+        ","
+    )
+    if field
+]
+NGRAM_SIZE: Final[int] = int(os.getenv("NGRAM_SIZE", 3))
 
 CORS_ALLOW_ORIGIN: Final[str] = os.getenv("CORS_ALLOW_ORIGIN", "*")
 CORS_ALLOW_METHOD: Final[str] = os.getenv("CORS_ALLOW_METHOD", "*")
 CORS_ALLOW_HEADER: Final[str] = os.getenv("CORS_ALLOW_HEADER", "*")
 
+SERVER_TIMING: Final[bool] = os.getenv("SERVER_TIMING", "false").lower() == "true"
+
+SLOW_QUERY_THRESHOLD: Final[Optional[float]] = (
+    float(os.getenv("SLOW_QUERY_THRESHOLD", "0")) or None
+)
+SLOW_QUERY_LOG: Final[str] = os.getenv("SLOW_QUERY_LOG", "slow_query.log")
+SLOW_QUERY_LOG_BYTES: Final[int] = int(
+    os.getenv("SLOW_QUERY_LOG_BYTES", 16 * 1024 * 1024)
+)
+SLOW_QUERY_LOG_BACKUPS: Final[int] = int(os.getenv("SLOW_QUERY_LOG_BACKUPS", 4))
+SLOW_QUERY_REWRITE: Final[bool] = (
+    os.getenv("SLOW_QUERY_REWRITE", "false").lower() == "true"
+)
+SLOW_QUERY_EXPLAIN: Final[bool] = (
+    os.getenv("SLOW_QUERY_EXPLAIN", "false").lower() == "true"
+)
+
+WARMUP_FILE: Final[Optional[str]] = os.getenv("WARMUP_FILE")
+
+# /admin/reload only reaches one worker, so with WEB_CONCURRENCY > 1 it is
+# rejected and every worker has to poll the index with INDEX_RELOAD_INTERVAL
+ADMIN_TOKEN: Final[Optional[str]] = os.getenv("ADMIN_TOKEN")
+INDEX_RELOAD_INTERVAL: Final[Optional[int]] = (
+    int(os.getenv("INDEX_RELOAD_INTERVAL", "0")) or None
+)
+
 MAX_PAGE_SIZE: Final[int] = int(os.getenv("MAX_PAGE_SIZE", 250))
+SUGGEST_PAGE_SIZE: Final[int] = int(os.getenv("SUGGEST_PAGE_SIZE", 10))
 IMAGE_URL_BASE: Final[Optional[str]] = os.getenv("IMAGE_URL_BASE")
+
+DOCUMENT_CACHE_SIZE: Final[int] = int(
+    os.getenv("DOCUMENT_CACHE_SIZE", 64 * 1024 * 1024)
+)
+QUERY_CACHE_SIZE: Final[int] = int(os.getenv("QUERY_CACHE_SIZE", 4096))
+RESULT_CACHE_SIZE: Final[int] = int(os.getenv("RESULT_CACHE_SIZE", 1024))
+RESULT_CACHE_BYTES: Final[int] = int(os.getenv("RESULT_CACHE_BYTES", 32 * 1024 * 1024))
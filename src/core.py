@@ -1,3 +1,4 @@
+import collections
 from typing import Callable
 from typing import Iterable
 from typing import Iterator
@@ -5,16 +6,39 @@ from typing import Mapping
 from typing import Optional
 
 import org
+from java.io import File
+from java.lang import Double
 from lupyne.engine import Analyzer
 from lupyne.engine import Field
 from lupyne.engine import Indexer
 from lupyne.engine import Query
+from lupyne.engine.documents import Hits
+from lupyne.engine.indexers import IndexSearcher
+from lupyne.engine.indexers import closing
+from lupyne.engine.utils import suppress
 from org.apache.lucene.analysis.core import KeywordTokenizer
 from org.apache.lucene.analysis.core import LetterTokenizer
 from org.apache.lucene.analysis.core import LowerCaseFilter
 from org.apache.lucene.analysis.core import UnicodeWhitespaceTokenizer
+from org.apache.lucene.index import DocValues
+from org.apache.lucene.index import DocValuesType
+from org.apache.lucene.index import MultiTerms
+from org.apache.lucene.index import PointValues
+from org.apache.lucene.index import SegmentInfos
+from org.apache.lucene.search import DocIdSetIterator
+from org.apache.lucene.search import FieldDoc
+from org.apache.lucene.search import MultiTermQuery
+from org.apache.lucene.search import ScoreDoc
+from org.apache.lucene.search import Sort
 from org.apache.lucene.search import SortField
 from org.apache.lucene.search import SortedSetSortField
+from org.apache.lucene.search import TimeLimitingCollector
+from org.apache.lucene.search import TopFieldCollector
+from org.apache.lucene.search import TopScoreDocCollector
+from org.apache.lucene.store import ByteBuffersDirectory
+from org.apache.lucene.store import FSDirectory
+from org.apache.lucene.store import IOContext
+from org.apache.lucene.store import MMapDirectory
 from org.apache.pylucene.queryparser.classic import PythonQueryParser
 from org.apache.pylucene.queryparser.complexPhrase import PythonComplexPhraseQueryParser
 
@@ -39,6 +63,9 @@ class AnalyzerEX(Analyzer):
 
 
 class PythonQueryParserMixin:
+    NGRAM_START = "\x02"
+    NGRAM_END = "\x03"
+
     def __init__(
         self,
         field: str,
@@ -52,6 +79,9 @@ class PythonQueryParserMixin:
         split_on_whitespace: Optional[bool] = None,
         numeric_fields: Optional[Iterable[str]] = None,
         numeric_like_fields: Optional[Mapping[str, str]] = None,
+        keyword_fields: Optional[Mapping[str, str]] = None,
+        ngram_fields: Optional[Mapping[str, str]] = None,
+        ngram_size: int = 3,
         field_value_maps: Optional[Mapping[str, Callable[[str], Optional[str]]]] = None,
     ):
         logger.debug("PythonQueryParserMixin%s", locals())
@@ -74,10 +104,17 @@ class PythonQueryParserMixin:
             numeric_fields = ()
         if numeric_like_fields is None:
             numeric_like_fields = {}
+        if keyword_fields is None:
+            keyword_fields = {}
+        if ngram_fields is None:
+            ngram_fields = {}
         if field_value_maps is None:
             field_value_maps = {}
         self.numeric_fields = {*numeric_fields, *numeric_like_fields}
         self.numeric_like_fields = numeric_like_fields
+        self.keyword_fields = {*keyword_fields.values()}
+        self.ngram_fields = ngram_fields
+        self.ngram_size = ngram_size
         self.field_value_maps = field_value_maps
 
     def _get_field_and_texts(
@@ -94,6 +131,29 @@ class PythonQueryParserMixin:
                     text = field_value_map(text)
             yield text
 
+    def _get_ngram_query(
+        self, field: str, text: str, start: bool, end: bool
+    ) -> Optional[Query]:
+        try:
+            ngram_field = self.ngram_fields[field]
+        except KeyError:
+            return None
+        # the second pass of the complex phrase parser only accepts term-like clauses
+        if self.getMultiTermRewriteMethod().equals(
+            MultiTermQuery.SCORING_BOOLEAN_REWRITE
+        ):
+            return None
+        _, text = self._get_field_and_texts(field, text)
+        text = "".join(
+            (self.NGRAM_START if start else "", text, self.NGRAM_END if end else "")
+        )
+        if len(text) < self.ngram_size:
+            return None
+        ngrams = self.get_ngrams(text, self.ngram_size)
+        if len(ngrams) == 1:
+            return Query.term(ngram_field, ngrams[0])
+        return Query.phrase(ngram_field, *ngrams)
+
     # noinspection PyPep8Naming
     def getFuzzyQuery(self, field: str, termText: str, minSimilarity: float) -> Query:
         logger.debug("getFuzzyQuery%s", locals())
@@ -105,6 +165,9 @@ class PythonQueryParserMixin:
     # noinspection PyPep8Naming
     def getPrefixQuery(self, field: str, termText: str) -> Query:
         logger.debug("getPrefixQuery%s", locals())
+        query = self._get_ngram_query(field, termText, True, False)
+        if query is not None:
+            return query
         # noinspection PyUnresolvedReferences
         return super().getPrefixQuery(*self._get_field_and_texts(field, termText))
 
@@ -140,12 +203,25 @@ class PythonQueryParserMixin:
     # noinspection PyPep8Naming
     def getWildcardQuery(self, field: str, termText: str) -> Query:
         logger.debug("getWildcardQuery%s", locals())
+        if "?" not in termText and "\\" not in termText:
+            texts = [text for text in termText.split("*") if text]
+            if len(texts) == 1:
+                query = self._get_ngram_query(
+                    field,
+                    texts[0],
+                    not termText.startswith("*"),
+                    not termText.endswith("*"),
+                )
+                if query is not None:
+                    return query
         # noinspection PyUnresolvedReferences
         return super().getWildcardQuery(*self._get_field_and_texts(field, termText))
 
     # noinspection PyPep8Naming
     def getFieldQuery_quoted(self, field: str, queryText: str, quoted: bool) -> Query:
         logger.debug("getFieldQuery_quoted%s", locals())
+        if field in self.keyword_fields:
+            return Query.term(*self._get_field_and_texts(field, queryText))
         numeric_like_field, queryText = self._get_field_and_texts(field, queryText)
         if field in self.numeric_fields:
             if self.is_numeric(queryText):
@@ -158,6 +234,8 @@ class PythonQueryParserMixin:
     # noinspection PyPep8Naming
     def getFieldQuery_slop(self, field: str, queryText: str, slop: int) -> Query:
         logger.debug("getFieldQuery_slop%s", locals())
+        if field in self.keyword_fields:
+            return Query.term(*self._get_field_and_texts(field, queryText))
         # noinspection PyUnresolvedReferences
         return super().getFieldQuery_slop_super(
             *self._get_field_and_texts(field, queryText), slop
@@ -172,6 +250,12 @@ class PythonQueryParserMixin:
         else:
             return True
 
+    @staticmethod
+    def get_ngrams(text: str, size: int) -> list[str]:
+        return [
+            text[index : index + size] for index in range(max(len(text) - size, 0) + 1)
+        ]
+
     @staticmethod
     def get_numeric(string: int | float | str) -> int | float:
         number = float(string)
@@ -240,7 +324,95 @@ class FieldEX(Field):
         return cls.Numeric(name, docValuesType=docValuesType, **settings)
 
 
+class IndexSearcherEX(IndexSearcher):
+    # noinspection PyMethodOverriding
+    def collector(
+        self,
+        count: Optional[int] = None,
+        sort=None,
+        reverse: bool = False,
+        scores: bool = False,
+        mincount: int = 1000,
+        after: Optional[ScoreDoc] = None,
+    ):
+        if after is None:
+            return super().collector(count, sort, reverse, scores, mincount)
+        count = min(count or self.maxDoc(), self.maxDoc()) or 1
+        mincount = max(count, mincount)
+        if sort is None:
+            return TopScoreDocCollector.create(count, after, mincount)
+        if isinstance(sort, str):
+            sort = self.sortfield(sort, reverse=reverse)
+        if not isinstance(sort, Sort):
+            sort = Sort(sort)
+        return TopFieldCollector.create(sort, count, FieldDoc.cast_(after), mincount)
+
+    # noinspection PyMethodOverriding
+    def search(
+        self,
+        query=None,
+        count: Optional[int] = None,
+        sort=None,
+        reverse: bool = False,
+        scores: bool = False,
+        mincount: int = 1000,
+        timeout: Optional[float] = None,
+        after: Optional[ScoreDoc] = None,
+        **parser,
+    ) -> Hits:
+        if after is None:
+            return super().search(
+                query, count, sort, reverse, scores, mincount, timeout, **parser
+            )
+        query = Query.alldocs() if query is None else self.parse(query, **parser)
+        results = collector = self.collector(
+            count, sort, reverse, scores, mincount, after
+        )
+        if timeout is not None:
+            results = TimeLimitingCollector(
+                collector,
+                TimeLimitingCollector.getGlobalCounter(),
+                int(timeout * 1000),
+            )
+        with suppress(TimeLimitingCollector.TimeExceededException):
+            super(IndexSearcher, self).search(query, results)
+        topdocs = collector.topDocs()
+        return Hits(self, topdocs.scoreDocs, topdocs.totalHits)
+
+
 class IndexerEX(Indexer):
+    _FILE_CATEGORIES = {
+        "tim": "postings",
+        "tip": "postings",
+        "tmd": "postings",
+        "doc": "postings",
+        "pos": "postings",
+        "pay": "postings",
+        "dvd": "docvalues",
+        "dvm": "docvalues",
+        "fdt": "stored",
+        "fdx": "stored",
+        "fdm": "stored",
+        "kdd": "points",
+        "kdi": "points",
+        "kdm": "points",
+        "nvd": "norms",
+        "nvm": "norms",
+        "tvd": "termvectors",
+        "tvx": "termvectors",
+        "tvm": "termvectors",
+    }
+    _DOCVALUES_READERS = {
+        "NUMERIC": (DocValues.getNumeric, lambda docvalues: docvalues.longValue()),
+        "BINARY": (DocValues.getBinary, lambda docvalues: docvalues.binaryValue()),
+        "SORTED": (DocValues.getSorted, lambda docvalues: docvalues.ordValue()),
+        "SORTED_NUMERIC": (
+            DocValues.getSortedNumeric,
+            lambda docvalues: docvalues.nextValue(),
+        ),
+        "SORTED_SET": (DocValues.getSortedSet, lambda docvalues: docvalues.nextOrd()),
+    }
+
     def __init__(
         self,
         directory: str,
@@ -248,11 +420,79 @@ class IndexerEX(Indexer):
         analyzer=None,
         version=None,
         nrt=False,
+        directory_strategy: Optional[str] = None,
         **attrs,
     ):
-        super().__init__(directory, mode, analyzer, version, nrt, **attrs)
+        self.directory_path = directory
+        self.directory_strategy = directory_strategy
+        if mode == "r":
+            # read-only: keep the writer api on an in-memory directory so that the
+            # write lock of the index directory stays free for index builds
+            super().__init__(
+                ByteBuffersDirectory(), "w", analyzer, version, False, **attrs
+            )
+            self.indexSearcher = self._open_searcher()
+        else:
+            super().__init__(directory, mode, analyzer, version, nrt, **attrs)
+            self.indexSearcher = IndexSearcherEX(
+                self.indexSearcher.indexReader, self.analyzer
+            )
         self.parser = PythonQueryParserEX
 
+    @property
+    def generation(self) -> int:
+        return self.indexSearcher.version
+
+    def _open_searcher(self) -> IndexSearcherEX:
+        path = File(self.directory_path).toPath()
+        if self.directory_strategy == "heap":
+            directory = ByteBuffersDirectory()
+            source = FSDirectory.open(path)
+            try:
+                for name in source.listAll():
+                    directory.copyFrom(source, name, name, IOContext.READONCE)
+            finally:
+                source.close()
+        else:
+            directory = MMapDirectory(path)
+            if self.directory_strategy == "mmap_preload":
+                directory.setPreload(MMapDirectory.ALL_FILES)
+        searcher = IndexSearcherEX(directory, self.analyzer)
+        searcher.shared.add(directory)
+        return searcher
+
+    def reopen_searcher(self) -> IndexSearcherEX:
+        searcher = self.indexSearcher
+        if self.directory_strategy != "heap":
+            return searcher.reopen()
+        with closing.store(self.directory_path) as directory:
+            version = SegmentInfos.readLatestCommit(directory).getVersion()
+        if version == searcher.version:
+            return searcher
+        return self._open_searcher()
+
+    def warm(self) -> int:
+        touched = 0
+        for context in self.indexSearcher.leaves():
+            leaf = context.reader()
+            for fieldinfo in leaf.getFieldInfos().iterator():
+                terms = leaf.terms(fieldinfo.name)
+                if terms is not None:
+                    terms_enum = terms.iterator()
+                    while terms_enum.next() is not None:
+                        touched += terms_enum.docFreq()
+                try:
+                    get_docvalues, read = self._DOCVALUES_READERS[
+                        fieldinfo.getDocValuesType().toString()
+                    ]
+                except KeyError:
+                    continue
+                docvalues = get_docvalues(leaf, fieldinfo.name)
+                for _ in iter(docvalues.nextDoc, DocIdSetIterator.NO_MORE_DOCS):
+                    read(docvalues)
+                    touched += 1
+        return touched
+
     # noinspection PyShadowingBuiltins
     def sortfield(
         self,
@@ -272,3 +512,63 @@ class IndexerEX(Indexer):
     def parse(self, query: str, spellcheck: bool = False, **kwargs) -> Query:
         kwargs.setdefault("parser", self.parser)
         return super().parse(query, spellcheck, **kwargs)
+
+    def optimize(self, segments: int = 1):
+        merge_policy = self.getConfig().getMergePolicy()
+        merge_policy.setNoCFSRatio(1.0)
+        merge_policy.setMaxCFSSegmentSizeMB(Double.POSITIVE_INFINITY)
+        self.commit(merge=segments)
+
+    def _get_file_category(self, name: str) -> str:
+        return self._FILE_CATEGORIES.get(name.rpartition(".")[2], "other")
+
+    def get_file_sizes(self) -> dict[str, int]:
+        sizes = collections.Counter()
+        directory = self.getDirectory()
+        for commit_info in SegmentInfos.readLatestCommit(directory):
+            info = commit_info.info
+            for name in commit_info.files():
+                if not name.endswith(".cfs"):
+                    sizes[self._get_file_category(name)] += directory.fileLength(name)
+            if info.getUseCompoundFile():
+                compound = (
+                    info.getCodec()
+                    .compoundFormat()
+                    .getCompoundReader(directory, info, IOContext.DEFAULT)
+                )
+                try:
+                    for name in compound.listAll():
+                        sizes[self._get_file_category(name)] += compound.fileLength(
+                            name
+                        )
+                finally:
+                    compound.close()
+        return dict(sizes)
+
+    def get_field_sizes(self) -> dict[str, dict[str, int | str]]:
+        searcher = self.indexSearcher
+        reader = searcher.indexReader
+        sizes = {}
+        for name, fieldinfo in searcher.fieldinfos.items():
+            size = sizes[name] = {}
+            terms = MultiTerms.getTerms(reader, name)
+            if terms is not None:
+                size["terms"] = terms.size()
+                size["postings"] = terms.getSumDocFreq()
+            if fieldinfo.docValuesType != DocValuesType.NONE:
+                size["docvalues"] = fieldinfo.docValuesType.toString()
+            if fieldinfo.getPointDimensionCount():
+                size["points"] = (
+                    PointValues.size(reader, name)
+                    * fieldinfo.getPointDimensionCount()
+                    * fieldinfo.getPointNumBytes()
+                )
+        stored_fields = searcher.storedFields()
+        for index in searcher:
+            for field in stored_fields.document(index).iterator():
+                value = field.stringValue()
+                size = sizes.setdefault(field.name(), {})
+                size["stored"] = size.get("stored", 0) + (
+                    len(value.encode()) if value is not None else 8
+                )
+        return sizes
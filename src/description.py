@@ -5,17 +5,22 @@ ERROR_400 = "Bad Request. Your request is either malformed, or is missing one or
 ERROR_402 = "The parameters were valid but the request failed."
 ERROR_403 = "The user doesn't have permissions to perform the request."
 ERROR_404 = "The requested resource was not found."
+ERROR_409 = "The request conflicts with the current state of the server."
 ERROR_429 = "The rate limit has been exceeded."
 ERROR_500 = "Something went wrong on our end."
+ERROR_503 = "The server is overloaded. Please retry the request later."
 
 ROUTE_CARD = "Fetch the details of a single card."
 ROUTE_SEARCH_CARD = "Search for one or many cards given a search query."
 ROUTE_SET = "Fetch the details of a single set."
 ROUTE_SEARCH_SET = "Search for one or many sets given a search query."
+ROUTE_SUGGEST_CARD = "Suggest card names matching what has been typed so far."
+ROUTE_SUGGEST_SET = "Suggest set names matching what has been typed so far."
 ROUTE_TYPES = "Get all possible types"
 ROUTE_SUBTYPES = "Get all possible subtypes"
 ROUTE_SUPERTYPES = "Get all possible supertypes"
 ROUTE_RARITIES = "Get all possible rarities"
+ROUTE_READY = "Check whether the server has finished warming up."
 
 PATH_CARD_ID = "The Id of the card"
 PATH_SET_ID = "The Id of the set"
@@ -28,3 +33,18 @@ QUERY_SEARCH_Q = "The search query."
 QUERY_SEARCH_PAGE = "The page of data to access."
 QUERY_SEARCH_PAGESIZE = "The maximum amount of cards to return."
 QUERY_SEARCH_ORDERBY = "The field(s) to order the results by."
+QUERY_SEARCH_FACETS = (
+    "A comma delimited list of fields to count the values of over every matching "
+    "result (ex. ?facets=rarity,types,set.id)."
+)
+QUERY_SEARCH_STATS = (
+    "A comma delimited list of numeric fields to compute count, min, max, avg, sum "
+    "and a value histogram of over every matching result (ex. ?stats=hp)."
+)
+QUERY_SUGGEST_PREFIX = "The text typed so far."
+QUERY_SUGGEST_PAGESIZE = "The maximum amount of suggestions to return."
+QUERY_SEARCH_CURSOR = (
+    "An opaque cursor for walking every result page by page (ex. ?cursor=*). "
+    "Pass * for the first page and nextCursor from the previous response afterwards, "
+    "with the same q and orderBy. The page parameter is ignored in this mode."
+)
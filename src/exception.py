@@ -12,9 +12,16 @@ class ExceptionEX(Exception):
 BadRequestException = ExceptionEX(
     description.ERROR_400, fastapi.status.HTTP_400_BAD_REQUEST
 )
+ForbiddenException = ExceptionEX(
+    description.ERROR_403, fastapi.status.HTTP_403_FORBIDDEN
+)
 NotFoundException = ExceptionEX(
     description.ERROR_404, fastapi.status.HTTP_404_NOT_FOUND
 )
+ConflictException = ExceptionEX(description.ERROR_409, fastapi.status.HTTP_409_CONFLICT)
 ServerErrorException = ExceptionEX(
     description.ERROR_500, fastapi.status.HTTP_500_INTERNAL_SERVER_ERROR
 )
+ServiceUnavailableException = ExceptionEX(
+    description.ERROR_503, fastapi.status.HTTP_503_SERVICE_UNAVAILABLE
+)
@@ -1,102 +1,344 @@
+import collections
+import concurrent.futures
+import contextlib
+import gc
 import glob
+import hashlib
+import multiprocessing
 import os
 import shutil
+import time
+from typing import Any
+from typing import Callable
 from typing import Iterable
+from typing import Iterator
+from typing import Mapping
+from typing import MutableMapping
+
+from org.apache.lucene.codecs.lucene99 import Lucene99Codec
 
 import config
+from common import attach_current_thread
 from common import json
 from common import logger
+from processing import STRING_SET_FIELDS
+from processing import iter_batches
+from processing import process_cards
+from processing import scan_cards
 from resource import CardResource
 from resource import RarityResource
+from resource import SchemaBuilderResource
 from resource import SchemaResource
 from resource import SetResource
+from resource import SourceResource
 from resource import StringSetResource
 from resource import SubTypeResource
 from resource import SuperTypeResource
 from resource import TypeResource
+from schema import SchemaBuilder
+from schema import SchemaFieldType
+
+_SOURCE_SETS = "sets/en.json"
+# subfields that documents only get when they are (re)indexed; an index built with
+# other options has to be rebuilt as a whole
+_SOURCE_OPTIONS = "options"
+
+
+def _iter_bounded(
+    executor: concurrent.futures.Executor,
+    fn: Callable,
+    args: Iterable[tuple],
+    size: int,
+) -> Iterator:
+    futures = collections.deque()
+    for arg in args:
+        if len(futures) >= size:
+            yield futures.popleft().result()
+        futures.append(executor.submit(fn, *arg))
+    while futures:
+        yield futures.popleft().result()
+
+
+@contextlib.contextmanager
+def _fork_executor() -> Iterator[concurrent.futures.ProcessPoolExecutor]:
+    # workers are forked so that they skip the VM start-up. They only run the code in
+    # processing, which never reaches the VM, and everything they inherit is frozen
+    # so that their garbage collector never visits a JCC wrapper either
+    gc.freeze()
+    try:
+        with concurrent.futures.ProcessPoolExecutor(
+            config.INDEX_WORKERS, mp_context=multiprocessing.get_context("fork")
+        ) as executor:
+            yield executor
+    finally:
+        gc.unfreeze()
+
+
+def _hash_cards(path: str, set_: dict) -> str:
+    hash_ = hashlib.sha256()
+    with open(path, "rb") as file:
+        hash_.update(file.read())
+    hash_.update(json.dumps(set_, sort_keys=True).encode())
+    return hash_.hexdigest()
+
+
+def _hash_options() -> str:
+    options = {
+        "keyword_fields": True,
+        "ngram_fields": sorted(config.NGRAM_FIELDS),
+        "ngram_size": config.NGRAM_SIZE,
+    }
+    return hashlib.sha256(json.dumps(options, sort_keys=True).encode()).hexdigest()
 
 
-def _dump_schema_resource(resource: SchemaResource, documents: Iterable[dict]):
+def _is_schema_compatible(
+    resource_class: type[SchemaResource],
+    index_dir: str,
+    schema_builders: Iterable[Mapping[str, SchemaFieldType]],
+) -> bool:
+    current = SchemaBuilderResource(
+        os.path.join(index_dir, resource_class.RESOURCE, "schema.json")
+    )
+    merged = SchemaBuilder(current)
+    for schema_builder in schema_builders:
+        merged.merge(schema_builder)
+    return all(merged[name] == field_type for name, field_type in current.items())
+
+
+def _add_documents(resource: SchemaResource, documents: Iterable[dict]):
+    for document in documents:
+        resource.add(document)
+
+
+def _get_writer_attrs() -> dict[str, Any]:
+    attrs = {}
+    if config.INDEX_BEST_COMPRESSION:
+        attrs["codec"] = Lucene99Codec(Lucene99Codec.Mode.BEST_COMPRESSION)
+    return attrs
+
+
+def _report_schema_resource(resource: SchemaResource):
+    for category, size in sorted(resource.get_file_sizes().items()):
+        logger.info(f"{resource.RESOURCE}: {category}={size}")
+    for name, size in sorted(resource.get_field_sizes().items()):
+        logger.info(f"{resource.RESOURCE}: {name}: {size}")
+
+
+def _dump_schema_resource(
+    resource: SchemaResource,
+    schema_builders: Iterable[Mapping[str, SchemaFieldType]],
+    batches: Iterable[list[dict]],
+    sources: Iterable[str] = (),
+    optimize: bool = False,
+):
     logger.debug("_dump_schema_resource%s", locals())
-    processed = [resource.process(document) for document in documents]
-    for document in processed:
-        resource.add_schema(document)
+    for schema_builder in schema_builders:
+        resource.schema_builder.merge(schema_builder)
     resource.commit_schema()
-    for document in processed:
-        resource.add(document)
+    for source in sources:
+        resource.delete(resource.FIELD_SOURCE, source)
+    with concurrent.futures.ThreadPoolExecutor(
+        config.INDEX_WORKERS, initializer=attach_current_thread
+    ) as executor:
+        args = ((resource, batch) for batch in batches)
+        for _ in _iter_bounded(
+            executor, _add_documents, args, 2 * config.INDEX_WORKERS
+        ):
+            pass
     resource.commit()
+    if optimize:
+        resource.optimize()
+        _report_schema_resource(resource)
     resource.schema_builder.dump()
+    resource.dump_indices()
+    resource.dump_suggester()
 
 
 def dump_index(
-    data_dir: str = config.DATA_DIRECTORY, index_dir: str = config.INDEX_DIRECTORY
+    data_dir: str = config.DATA_DIRECTORY,
+    index_dir: str = config.INDEX_DIRECTORY,
+    incremental: bool = config.INDEX_INCREMENTAL,
 ):
     logger.debug("dump_index%s", locals())
-    shutil.rmtree(index_dir, ignore_errors=True)
+    with open(os.path.join(data_dir, _SOURCE_SETS), "rb") as file:
+        content = file.read()
+    sets = {set_["id"]: set_ for set_ in json.loads(content)}
+    sources = {
+        _SOURCE_OPTIONS: _hash_options(),
+        _SOURCE_SETS: hashlib.sha256(content).hexdigest(),
+    }
+    paths = []
+    for path in sorted(glob.glob(os.path.join(data_dir, "cards/en/*.json"))):
+        set_ = sets[os.path.basename(path).removesuffix(".json")]
+        source = os.path.relpath(path, data_dir)
+        sources[source] = _hash_cards(path, set_)
+        paths.append((path, set_, source))
 
-    sets = {}
-    with open(os.path.join(data_dir, "sets/en.json"), "rb") as file:
-        for set_ in json.load(file):
-            sets[set_["id"]] = set_
+    source_resource = SourceResource(index_dir)
+    incremental = incremental and bool(source_resource)
+    if incremental and source_resource.get(_SOURCE_OPTIONS) != sources[_SOURCE_OPTIONS]:
+        logger.info("Index options changed, rebuilding the whole index")
+        incremental = False
+    if not incremental:
+        shutil.rmtree(index_dir, ignore_errors=True)
+        source_resource.clear()
+    changed = {
+        source
+        for source, hash_ in sources.items()
+        if source_resource.get(source) != hash_
+    }
+    removed = source_resource.keys() - sources.keys()
+    logger.info(f"{len(changed)=}")
+    logger.info(f"{len(removed)=}")
+    if not changed and not removed:
+        return
+    paths = [(path, set_, source) for path, set_, source in paths if source in changed]
 
-    type_resource = TypeResource(index_dir)
-    sub_type_resource = SubTypeResource(index_dir)
-    super_type_resource = SuperTypeResource(index_dir)
-    rarity_resource = RarityResource(index_dir)
+    string_set_resources = dict(
+        zip(
+            STRING_SET_FIELDS,
+            (
+                TypeResource(index_dir),
+                SubTypeResource(index_dir),
+                SuperTypeResource(index_dir),
+                RarityResource(index_dir),
+            ),
+        )
+    )
 
-    cards = []
-    for path in glob.glob(os.path.join(data_dir, "cards/en/*.json")):
-        set_ = sets[os.path.basename(path).removesuffix(".json")]
-        with open(path, "rb") as file:
-            for card in json.load(file):
-                card["set"] = set_
-                if "types" in card:
-                    type_resource.update(card["types"])
-                if "subtypes" in card:
-                    sub_type_resource.update(card["subtypes"])
-                if "supertype" in card:
-                    super_type_resource.add(card["supertype"])
-                if "rarity" in card:
-                    rarity_resource.add(card["rarity"])
-                cards.append(card)
-    sets = sets.values()
-
-    logger.info(f"{len(cards)=}")
-    logger.info(f"{len(sets)=}")
-    logger.info(f"{len(type_resource)=}")
-    logger.info(f"{len(sub_type_resource)=}")
-    logger.info(f"{len(super_type_resource)=}")
-    logger.info(f"{len(rarity_resource)=}")
+    schema_builders = []
+    counts = []
+    with _fork_executor() as executor:
+        for schema_builder, string_sets, count in _iter_bounded(
+            executor,
+            scan_cards,
+            ((path, set_) for path, set_, _ in paths),
+            2 * config.INDEX_WORKERS,
+        ):
+            schema_builders.append(schema_builder)
+            counts.append(count)
+            for name, string_set in string_sets.items():
+                string_set_resources[name].update(string_set)
+
+    if incremental and not _is_schema_compatible(
+        CardResource, index_dir, schema_builders
+    ):
+        logger.info("Card schema changed, rebuilding the whole index")
+        return dump_index(data_dir, index_dir, False)
 
-    type_resource.dump()
-    sub_type_resource.dump()
-    super_type_resource.dump()
-    rarity_resource.dump()
+    logger.info(f"{len(paths)=}")
+    logger.info(f"{len(sets)=}")
+    for resource in string_set_resources.values():
+        logger.info(f"len({resource.RESOURCE})={len(resource)}")
+        resource.dump()
 
     logger.info("Building card index")
-    _dump_schema_resource(CardResource(index_dir, "w"), cards)
+    # workers hand back one batch per slice of a file, so at most
+    # 2 * INDEX_WORKERS batches of processed documents are in flight
+    slices = (
+        (path, set_, source, offset, config.INDEX_BATCH_SIZE)
+        for (path, set_, source), count in zip(paths, counts)
+        for offset in range(0, count, config.INDEX_BATCH_SIZE)
+    )
+    with _fork_executor() as executor:
+        _dump_schema_resource(
+            CardResource(
+                index_dir,
+                "a" if incremental else "w",
+                ngram_fields=config.NGRAM_FIELDS,
+                ngram_size=config.NGRAM_SIZE,
+                **_get_writer_attrs(),
+            ),
+            schema_builders,
+            _iter_bounded(executor, process_cards, slices, 2 * config.INDEX_WORKERS),
+            (
+                (changed | removed) - {_SOURCE_OPTIONS, _SOURCE_SETS}
+                if incremental
+                else ()
+            ),
+            config.INDEX_OPTIMIZE and not incremental,
+        )
+
+    if _SOURCE_SETS in changed:
+        logger.info("Building set index")
+        set_schema_builder = SchemaBuilder()
+        processed = list(map(SetResource.process, sets.values()))
+        for document in processed:
+            set_schema_builder.add(document)
+        set_resource = SetResource(
+            index_dir,
+            "w",
+            ngram_fields=config.NGRAM_FIELDS,
+            ngram_size=config.NGRAM_SIZE,
+            **_get_writer_attrs(),
+        )
+        set_resource.schema_builder.clear()
+        _dump_schema_resource(
+            set_resource,
+            (set_schema_builder,),
+            iter_batches(processed),
+            optimize=config.INDEX_OPTIMIZE,
+        )
 
-    logger.info("Building set index")
-    _dump_schema_resource(SetResource(index_dir, "w"), sets)
+    source_resource.set_state(sources)
+    source_resource.dump()
 
 
 def load_index(
     index_dir: str = config.INDEX_DIRECTORY,
 ) -> dict[str, SchemaResource | StringSetResource]:
     logger.debug("load_index%s", locals())
-    return {
+    start = time.perf_counter()
+    resources = {
         CardResource.RESOURCE: CardResource(
             index_dir,
             search_count=config.LUCENE_COUNT,
+            search_min_count=config.LUCENE_MIN_COUNT,
             search_timeout=config.LUCENE_TIMEOUT,
             image_url_base=config.IMAGE_URL_BASE,
+            document_cache_size=config.DOCUMENT_CACHE_SIZE,
+            result_cache_size=config.RESULT_CACHE_SIZE,
+            result_cache_bytes=config.RESULT_CACHE_BYTES,
+            query_cache_size=config.QUERY_CACHE_SIZE,
+            directory_strategy=config.LUCENE_DIRECTORY,
+            ngram_fields=config.NGRAM_FIELDS,
+            ngram_size=config.NGRAM_SIZE,
         ),
         SetResource.RESOURCE: SetResource(
             index_dir,
             search_count=config.LUCENE_COUNT,
+            search_min_count=config.LUCENE_MIN_COUNT,
             search_timeout=config.LUCENE_TIMEOUT,
             image_url_base=config.IMAGE_URL_BASE,
+            document_cache_size=config.DOCUMENT_CACHE_SIZE,
+            result_cache_size=config.RESULT_CACHE_SIZE,
+            result_cache_bytes=config.RESULT_CACHE_BYTES,
+            query_cache_size=config.QUERY_CACHE_SIZE,
+            directory_strategy=config.LUCENE_DIRECTORY,
+            ngram_fields=config.NGRAM_FIELDS,
+            ngram_size=config.NGRAM_SIZE,
         ),
+        **load_string_set_index(index_dir),
+    }
+    logger.info("load_index%s", {"seconds": time.perf_counter() - start})
+    if config.LUCENE_WARM:
+        start = time.perf_counter()
+        touched = {
+            name: resource.warm()
+            for name, resource in resources.items()
+            if isinstance(resource, SchemaResource)
+        }
+        logger.info(
+            "warm%s", {"seconds": time.perf_counter() - start, "touched": touched}
+        )
+    return resources
+
+
+def load_string_set_index(
+    index_dir: str = config.INDEX_DIRECTORY,
+) -> dict[str, StringSetResource]:
+    logger.debug("load_string_set_index%s", locals())
+    return {
         TypeResource.RESOURCE: TypeResource(index_dir),
         SubTypeResource.RESOURCE: SubTypeResource(index_dir),
         SuperTypeResource.RESOURCE: SuperTypeResource(index_dir),
@@ -104,6 +346,22 @@ def load_index(
     }
 
 
+def reload_index(
+    resources: MutableMapping[str, SchemaResource | StringSetResource],
+    index_dir: str = config.INDEX_DIRECTORY,
+) -> dict[str, bool]:
+    logger.debug("reload_index%s", locals())
+    reloaded = {
+        name: resource.reopen()
+        for name, resource in tuple(resources.items())
+        if isinstance(resource, SchemaResource)
+    }
+    if any(reloaded.values()):
+        resources.update(load_string_set_index(index_dir))
+    logger.info(f"{reloaded=}")
+    return reloaded
+
+
 def main():
     dump_index()
 
@@ -1,43 +1,191 @@
+import asyncio
+import concurrent.futures
 import functools
+import os
+import secrets
 import time
 from contextlib import asynccontextmanager
+from typing import Any
+from typing import Callable
+from typing import Iterator
+from typing import Mapping
 from typing import NoReturn
 from typing import Optional
 
 import fastapi
-import lucene
 import uvicorn
 from fastapi import FastAPI
+from fastapi import Header
 from fastapi import Path
 from fastapi import Query
 from fastapi import Request
+from fastapi import Response
 from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import PlainTextResponse
+from java.lang import Runtime
+from lupyne.engine.documents import Hits
 
 import config
 import description
 import exception
 import init
+import metrics
+from cache import SingleFlight
 from common import JSONResponse
+from common import RawJSONResponse
+from common import dumps_raw
+from common import json
+from common import logger
+from common import slow_query_logger
 from exception import ExceptionEX
 from model import CardModel
 from model import ExceptionModel
 from model import SearchCardModel
 from model import SearchSetModel
 from model import SetModel
+from model import SimpleModel
 from model import StringSetModel
+from model import SuggestModel
+from resource import SchemaResource
+from worker import WorkerPool
 
 RESOURCES = {}
+SINGLE_FLIGHT = SingleFlight()
+WORKERS = {}
+READY = asyncio.Event()
 
 
 @asynccontextmanager
 async def lifespan(_: FastAPI):
     RESOURCES.update(init.load_index())
+    _log_memory_budget()
+    WORKERS["lucene"] = WorkerPool(config.LUCENE_WORKERS, config.LUCENE_QUEUE_SIZE)
+    tasks = []
+    # uvicorn only accepts connections once the lifespan yields, so the warm-up runs
+    # in the background and /ready answers 503 until it has finished
+    if config.WARMUP_FILE is not None:
+        tasks.append(asyncio.create_task(_warm_up_then_ready(config.WARMUP_FILE)))
+    else:
+        READY.set()
+    if config.INDEX_RELOAD_INTERVAL is not None:
+        tasks.append(asyncio.create_task(_reload_index_periodically()))
     yield
+    READY.clear()
+    for task in tasks:
+        task.cancel()
+    WORKERS.pop("lucene").shutdown()
     RESOURCES.clear()
 
 
+def _log_memory_budget():
+    # every worker process owns a whole VM: JCC cannot carry a started VM across
+    # fork, so workers are spawned and only the mmapped index pages are shared
+    heap = Runtime.getRuntime().maxMemory()
+    caches = sum(
+        (resource.document_cache.maxbytes or 0) + (resource.result_cache.maxbytes or 0)
+        for resource in RESOURCES.values()
+        if isinstance(resource, SchemaResource)
+    )
+    index = sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(config.INDEX_DIRECTORY)
+        for name in names
+    )
+    logger.info(
+        "memory_budget%s",
+        {
+            "workers": config.WEB_CONCURRENCY,
+            "heap": heap,
+            "caches": caches,
+            "worker": heap + caches,
+            "total": config.WEB_CONCURRENCY * (heap + caches),
+            "shared_index": index,
+        },
+    )
+
+
+def _warm_up_search(items: Mapping[str, Any]) -> bytes:
+    page, page_size = _clamp_page(
+        items.get("page", 1), items.get("pageSize", config.MAX_PAGE_SIZE)
+    )
+    return _search_schema_resource_content(
+        items.get("resource", "card"),
+        items.get("q"),
+        page,
+        page_size,
+        items.get("orderBy"),
+        items.get("select"),
+        None,
+        items.get("facets"),
+        items.get("stats"),
+    )
+
+
+async def _warm_up(path: str):
+    start = time.perf_counter()
+    with open(path, "r") as file:
+        lines = [json.loads(line) for line in file if line.strip()]
+    failed = 0
+    for index in range(0, len(lines), config.LUCENE_WORKERS):
+        futures = [
+            asyncio.wrap_future(WORKERS["lucene"].submit(_warm_up_search, items))
+            for items in lines[index : index + config.LUCENE_WORKERS]
+        ]
+        for result in await asyncio.gather(*futures, return_exceptions=True):
+            if isinstance(result, BaseException):
+                logger.debug("_warm_up%s", {"except": result})
+                failed += 1
+    logger.info(
+        "_warm_up%s",
+        {
+            "seconds": time.perf_counter() - start,
+            "count": len(lines),
+            "failed": failed,
+        },
+    )
+
+
+async def _warm_up_then_ready(path: str):
+    try:
+        await _warm_up(path)
+    except Exception as exc:
+        logger.error("_warm_up_then_ready%s", {"except": exc}, exc_info=exc)
+    READY.set()
+
+
+def _reload_index() -> dict[str, bool]:
+    reloaded = init.reload_index(RESOURCES)
+    if any(reloaded.values()):
+        _get_string_set_resource_cached.cache_clear()
+    return reloaded
+
+
+async def _reload_index_periodically() -> NoReturn:
+    while True:
+        await asyncio.sleep(config.INDEX_RELOAD_INTERVAL)
+        try:
+            await _wait_shared(
+                SINGLE_FLIGHT.submit(
+                    _reload_index, WORKERS["lucene"].submit, _reload_index
+                )
+            )
+        except Exception as exc:
+            logger.error("_reload_index_periodically%s", {"except": exc}, exc_info=exc)
+
+
+async def _wait_shared(future: concurrent.futures.Future) -> Any:
+    # the future is shared by every coalesced request, so a cancelled waiter must
+    # only stop waiting instead of cancelling the work for the others
+    return await asyncio.shield(asyncio.wrap_future(future))
+
+
+async def _run(key: tuple, fn: Callable, *args) -> Response:
+    future = SINGLE_FLIGHT.submit(key, WORKERS["lucene"].submit, fn, *args)
+    return RawJSONResponse(await _wait_shared(future))
+
+
 app = FastAPI(
     debug=config.FASTAPI_DEBUG,
     title=description.TITLE,
@@ -85,7 +233,7 @@ _ = {
     },
     fastapi.status.HTTP_503_SERVICE_UNAVAILABLE: {
         "model": ExceptionModel,
-        "description": description.ERROR_500,
+        "description": description.ERROR_503,
     },
     fastapi.status.HTTP_504_GATEWAY_TIMEOUT: {
         "model": ExceptionModel,
@@ -94,66 +242,199 @@ _ = {
 }
 
 
-def _get_schema_resource(
+async def _get_schema_resource(
     name: str, id_: str, select: Optional[list[str]]
-) -> JSONResponse:
+) -> Response:
     id_ = id_.strip().lower()
+    key = _get_schema_resource, name, id_, tuple(select or ())
+    return await _run(key, _get_schema_resource_content, name, id_, select)
+
+
+def _get_schema_resource_content(
+    name: str, id_: str, select: Optional[list[str]]
+) -> bytes:
     if id_.isdigit():
         id_ = int(id_)
-    # noinspection PyUnresolvedReferences
-    lucene.getVMEnv().attachCurrentThread()
     resource = RESOURCES[name]
     try:
-        hits = (resource[id_],)
+        hits = resource.lookup(id_)
     except IndexError:
         raise exception.NotFoundException
-    else:
-        return JSONResponse({"data": next(resource.iter_hits(hits, select))})
+    with metrics.phase("fetch"):
+        data = next(resource.iter_raw_hits(hits, select))
+    with metrics.phase("encode"):
+        return dumps_raw({}, data=data).encode()
+
 
+def _clamp_page(page: int, page_size: int) -> tuple[int, int]:
+    return max(1, page), max(1, min(page_size, config.MAX_PAGE_SIZE))
 
-def _search_schema_resource(
+
+async def _search_schema_resource(
     name: str,
     q: Optional[str],
     page: int,
     page_size: int,
     order_by: Optional[list[str]],
     select: Optional[list[str]],
-) -> JSONResponse:
-    page = max(1, page)
-    page_size = max(1, min(page_size, config.MAX_PAGE_SIZE))
-    # noinspection PyUnresolvedReferences
-    lucene.getVMEnv().attachCurrentThread()
-    resource = RESOURCES[name]
-    hits = resource.search(q, order_by)
-    # noinspection PyTypeChecker
-    data = list(
-        resource.iter_hits(hits, select, (page - 1) * page_size, page * page_size)
+    cursor: Optional[str],
+    facets: Optional[list[str]],
+    stats: Optional[list[str]],
+) -> Response:
+    page, page_size = _clamp_page(page, page_size)
+    key = (
+        _search_schema_resource,
+        name,
+        q,
+        page,
+        page_size,
+        tuple(order_by or ()),
+        tuple(select or ()),
+        cursor,
+        tuple(facets or ()),
+        tuple(stats or ()),
     )
-    return JSONResponse(
-        {
-            "data": data,
-            "page": page,
-            "pageSize": page_size,
-            "count": len(data),
-            "totalCount": len(hits),
-        }
+    return await _run(
+        key,
+        _search_schema_resource_content,
+        name,
+        q,
+        page,
+        page_size,
+        order_by,
+        select,
+        cursor,
+        facets,
+        stats,
     )
 
 
+def _search_schema_resource_content(
+    name: str,
+    q: Optional[str],
+    page: int,
+    page_size: int,
+    order_by: Optional[list[str]],
+    select: Optional[list[str]],
+    cursor: Optional[str],
+    facets: Optional[list[str]],
+    stats: Optional[list[str]],
+) -> bytes:
+    start_time = time.perf_counter()
+    resource = RESOURCES[name]
+    if cursor is None:
+        hits = resource.search(q, order_by, page * page_size)
+        start = (page - 1) * page_size
+    else:
+        try:
+            after = None if cursor == "*" else resource.get_after(cursor, order_by)
+        except ValueError:
+            raise exception.BadRequestException
+        hits = resource.search(q, order_by, page_size, after=after)
+        start = 0
+    with metrics.phase("fetch"):
+        # noinspection PyTypeChecker
+        data = list(resource.iter_raw_hits(hits, select, start))
+    content = {
+        "page": page,
+        "pageSize": page_size,
+        "count": len(data),
+        "totalCount": int(hits.count),
+    }
+    if cursor is not None:
+        content["nextCursor"] = (
+            resource.get_cursor(hits, order_by) if len(hits) == page_size else None
+        )
+    if facets or stats:
+        collector = resource.get_facets_collector(hits, q)
+        if facets:
+            content["facets"] = resource.get_facets(hits, collector, facets)
+        if stats:
+            content["stats"] = resource.get_stats(collector, stats)
+    with metrics.phase("encode"):
+        body = dumps_raw(content, data=f"[{','.join(data)}]").encode()
+    runtime = time.perf_counter() - start_time
+    if (
+        config.SLOW_QUERY_THRESHOLD is not None
+        and runtime > config.SLOW_QUERY_THRESHOLD
+    ):
+        _log_slow_query(resource, q, order_by, hits, runtime)
+    return body
+
+
+async def _suggest_schema_resource(name: str, prefix: str, page_size: int) -> Response:
+    page_size = max(1, min(page_size, config.MAX_PAGE_SIZE))
+    key = _suggest_schema_resource, name, prefix, page_size
+    return await _run(key, _suggest_schema_resource_content, name, prefix, page_size)
+
+
+def _suggest_schema_resource_content(name: str, prefix: str, page_size: int) -> bytes:
+    with metrics.phase("search"):
+        data = RESOURCES[name].suggest(prefix, page_size)
+    with metrics.phase("encode"):
+        return json.dumps({"data": data}).encode()
+
+
+def _log_slow_query(
+    resource: SchemaResource,
+    q: Optional[str],
+    order_by: Optional[list[str]],
+    hits: Hits,
+    runtime: float,
+):
+    try:
+        description = resource.describe_query(
+            q, hits, config.SLOW_QUERY_REWRITE, config.SLOW_QUERY_EXPLAIN
+        )
+    except Exception as exc:
+        logger.error("_log_slow_query%s", {"except": exc}, exc_info=exc)
+        description = {}
+    slow_query_logger.info(
+        json.dumps(
+            {
+                "time": time.time(),
+                "resource": resource.RESOURCE,
+                "q": q,
+                "orderBy": order_by,
+                "sort": resource.get_sort_key(order_by),
+                "count": hits.count,
+                "runtime": runtime,
+                "phases": dict(metrics.PHASES.get() or {}),
+                **description,
+            }
+        )
+    )
+
+
+# noinspection PyPep8Naming
+@app.get(
+    "/cards/suggest",
+    response_model=SuggestModel,
+    description=description.ROUTE_SUGGEST_CARD,
+)
+async def suggest_cards(
+    prefix: str = Query(description=description.QUERY_SUGGEST_PREFIX),
+    pageSize: int = Query(
+        config.SUGGEST_PAGE_SIZE, description=description.QUERY_SUGGEST_PAGESIZE
+    ),
+) -> JSONResponse:
+    return await _suggest_schema_resource("card", prefix, pageSize)
+
+
 # noinspection PyShadowingBuiltins
 @app.get("/cards/{id}", response_model=CardModel, description=description.ROUTE_CARD)
-def get_a_card(
+async def get_a_card(
     id: str = Path(description=description.PATH_CARD_ID),
     select: Optional[list[str]] = Query(None, description=description.QUERY_SELECT),
 ) -> JSONResponse:
-    return _get_schema_resource("card", id, select)
+    return await _get_schema_resource("card", id, select)
 
 
 # noinspection PyPep8Naming
 @app.get(
     "/cards", response_model=SearchCardModel, description=description.ROUTE_SEARCH_CARD
 )
-def search_cards(
+async def search_cards(
     q: str = Query(None, description=description.QUERY_SEARCH_Q),
     page: int = Query(1, description=description.QUERY_SEARCH_PAGE),
     pageSize: int = Query(
@@ -163,24 +444,48 @@ def search_cards(
         None, description=description.QUERY_SEARCH_ORDERBY
     ),
     select: Optional[list[str]] = Query(None, description=description.QUERY_SELECT),
+    cursor: Optional[str] = Query(None, description=description.QUERY_SEARCH_CURSOR),
+    facets: Optional[list[str]] = Query(
+        None, description=description.QUERY_SEARCH_FACETS
+    ),
+    stats: Optional[list[str]] = Query(
+        None, description=description.QUERY_SEARCH_STATS
+    ),
+) -> JSONResponse:
+    return await _search_schema_resource(
+        "card", q, page, pageSize, orderBy, select, cursor, facets, stats
+    )
+
+
+# noinspection PyPep8Naming
+@app.get(
+    "/sets/suggest",
+    response_model=SuggestModel,
+    description=description.ROUTE_SUGGEST_SET,
+)
+async def suggest_sets(
+    prefix: str = Query(description=description.QUERY_SUGGEST_PREFIX),
+    pageSize: int = Query(
+        config.SUGGEST_PAGE_SIZE, description=description.QUERY_SUGGEST_PAGESIZE
+    ),
 ) -> JSONResponse:
-    return _search_schema_resource("card", q, page, pageSize, orderBy, select)
+    return await _suggest_schema_resource("set", prefix, pageSize)
 
 
 # noinspection PyShadowingBuiltins
 @app.get("/sets/{id}", response_model=SetModel, description=description.ROUTE_SET)
-def get_a_set(
+async def get_a_set(
     id: str = Path(description=description.PATH_SET_ID),
     select: Optional[list[str]] = Query(None, description=description.QUERY_SELECT),
 ) -> JSONResponse:
-    return _get_schema_resource("set", id, select)
+    return await _get_schema_resource("set", id, select)
 
 
 # noinspection PyPep8Naming
 @app.get(
     "/sets", response_model=SearchSetModel, description=description.ROUTE_SEARCH_SET
 )
-def search_sets(
+async def search_sets(
     q: str = Query(None, description=description.QUERY_SEARCH_Q),
     page: int = Query(1, description=description.QUERY_SEARCH_PAGE),
     pageSize: int = Query(
@@ -190,8 +495,17 @@ def search_sets(
         None, description=description.QUERY_SEARCH_ORDERBY
     ),
     select: Optional[list[str]] = Query(None, description=description.QUERY_SELECT),
+    cursor: Optional[str] = Query(None, description=description.QUERY_SEARCH_CURSOR),
+    facets: Optional[list[str]] = Query(
+        None, description=description.QUERY_SEARCH_FACETS
+    ),
+    stats: Optional[list[str]] = Query(
+        None, description=description.QUERY_SEARCH_STATS
+    ),
 ) -> JSONResponse:
-    return _search_schema_resource("set", q, page, pageSize, orderBy, select)
+    return await _search_schema_resource(
+        "set", q, page, pageSize, orderBy, select, cursor, facets, stats
+    )
 
 
 @functools.cache
@@ -235,11 +549,107 @@ def get_rarities() -> JSONResponse:
     return _get_string_set_resource("rarity")
 
 
+@app.get("/ready", response_model=SimpleModel, description=description.ROUTE_READY)
+async def get_ready() -> JSONResponse:
+    if not READY.is_set():
+        raise exception.ServiceUnavailableException
+    return JSONResponse({"data": "ok"})
+
+
+@app.post("/admin/reload", include_in_schema=False)
+async def reload_index(
+    x_admin_token: Optional[str] = Header(None),
+) -> JSONResponse:
+    if config.ADMIN_TOKEN is None:
+        raise exception.NotFoundException
+    if x_admin_token is None or not secrets.compare_digest(
+        x_admin_token, config.ADMIN_TOKEN
+    ):
+        raise exception.ForbiddenException
+    if config.WEB_CONCURRENCY > 1:
+        # only the worker serving this request would reload, so multi-worker
+        # deployments must rely on INDEX_RELOAD_INTERVAL instead
+        raise exception.ConflictException
+    reloaded = await _wait_shared(
+        SINGLE_FLIGHT.submit(_reload_index, WORKERS["lucene"].submit, _reload_index)
+    )
+    return JSONResponse({"data": reloaded})
+
+
+def _iter_metrics() -> Iterator[str]:
+    yield from metrics.REGISTRY.iter_lines()
+    schema_resources = {
+        name: resource
+        for name, resource in RESOURCES.items()
+        if isinstance(resource, SchemaResource)
+    }
+    cache_stats = [
+        ({"resource": name, "cache": cache}, stats)
+        for name, resource in schema_resources.items()
+        for cache, stats in (
+            ("document", resource.document_cache.get_stats()),
+            ("result", resource.result_cache.get_stats()),
+            ("query", resource.query_cache.get_stats()),
+        )
+    ]
+    for stat in ("size", "bytes", "hits", "misses", "evictions", "hit_rate"):
+        yield from metrics.iter_gauges(
+            f"cache_{stat}", ((labels, stats[stat]) for labels, stats in cache_stats)
+        )
+    yield from metrics.iter_gauges(
+        "index_generation",
+        (
+            ({"resource": name}, resource.generation)
+            for name, resource in schema_resources.items()
+        ),
+    )
+    if "lucene" in WORKERS:
+        for stat, value in WORKERS["lucene"].get_stats().items():
+            yield from metrics.iter_gauges(f"lucene_pool_{stat}", (({}, value),))
+    for stat, value in SINGLE_FLIGHT.get_stats().items():
+        yield from metrics.iter_gauges(f"single_flight_{stat}", (({}, value),))
+    runtime = Runtime.getRuntime()
+    yield from metrics.iter_gauges(
+        "jvm_memory_bytes",
+        (
+            ({"area": "max"}, runtime.maxMemory()),
+            ({"area": "total"}, runtime.totalMemory()),
+            ({"area": "free"}, runtime.freeMemory()),
+        ),
+    )
+
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics() -> PlainTextResponse:
+    return PlainTextResponse(
+        "\n".join(_iter_metrics()) + "\n", media_type="text/plain; version=0.0.4"
+    )
+
+
 @app.middleware("http")
 async def add_runtime_header_middleware(request: Request, call_next):
+    phases = {}
+    token = metrics.PHASES.set(phases)
     start_time = time.monotonic()
-    response = await call_next(request)
-    response.headers["X-Runtime"] = str(time.monotonic() - start_time)
+    try:
+        response = await call_next(request)
+    finally:
+        metrics.PHASES.reset(token)
+    runtime = time.monotonic() - start_time
+    response.headers["X-Runtime"] = str(runtime)
+    route = request.scope.get("route")
+    if route is not None:
+        path = route.path
+        metrics.REGISTRY.observe("http_request_duration_seconds", runtime, route=path)
+        for name, seconds in phases.items():
+            metrics.REGISTRY.observe(
+                "http_request_phase_seconds", seconds, route=path, phase=name
+            )
+    if config.SERVER_TIMING:
+        response.headers["Server-Timing"] = ", ".join(
+            f"{name};dur={seconds * 1000:.3f}"
+            for name, seconds in (*phases.items(), ("total", runtime))
+        )
     return response
 
 
@@ -264,7 +674,7 @@ async def request_validation_error_handler(
 
 
 def main():
-    uvicorn.run(app)
+    uvicorn.run("main:app", workers=config.WEB_CONCURRENCY)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,98 @@
+import bisect
+import contextlib
+import contextvars
+import threading
+import time
+from typing import Iterable
+from typing import Iterator
+from typing import Mapping
+from typing import Optional
+
+_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+PHASES: contextvars.ContextVar[Optional[dict[str, float]]] = contextvars.ContextVar(
+    "PHASES", default=None
+)
+
+
+class Histogram:
+    def __init__(self, buckets: Iterable[float] = _BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def iter_samples(self, name: str, labels: str) -> Iterator[str]:
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        cumulative = 0
+        for bucket, bucket_count in zip((*self.buckets, "+Inf"), counts):
+            cumulative += bucket_count
+            yield f'{name}_bucket{{{labels},le="{bucket}"}} {cumulative}'
+        yield f"{name}_sum{{{labels}}} {total}"
+        yield f"{name}_count{{{labels}}} {count}"
+
+
+class Registry:
+    def __init__(self):
+        self.histograms: dict[tuple[str, tuple[tuple[str, str], ...]], Histogram] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float, **labels: str):
+        key = name, tuple(sorted(labels.items()))
+        try:
+            histogram = self.histograms[key]
+        except KeyError:
+            with self._lock:
+                histogram = self.histograms.setdefault(key, Histogram())
+        histogram.observe(value)
+
+    def iter_lines(self) -> Iterator[str]:
+        names = set()
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            if name not in names:
+                yield f"# TYPE {name} histogram"
+                names.add(name)
+            yield from histogram.iter_samples(name, format_labels(dict(labels)))
+
+
+REGISTRY = Registry()
+
+
+def _escape(value: object) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels: Mapping[str, object]) -> str:
+    return ",".join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+
+
+def iter_gauges(
+    name: str, samples: Iterable[tuple[Mapping[str, object], float]]
+) -> Iterator[str]:
+    yield f"# TYPE {name} gauge"
+    for labels, value in samples:
+        yield f"{name}{{{format_labels(labels)}}} {value}"
+
+
+@contextlib.contextmanager
+def phase(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_phase(name, time.perf_counter() - start)
+
+
+def add_phase(name: str, seconds: float):
+    phases = PHASES.get()
+    if phases is not None:
+        phases[name] = phases.get(name, 0.0) + seconds
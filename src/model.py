@@ -1,5 +1,6 @@
 from dataclasses import dataclass
 from typing import Any
+from typing import Optional
 
 from pokemontcgsdk import Card
 from pokemontcgsdk import Set
@@ -15,6 +16,16 @@ class SchemaModel(SimpleModel):
     data: Card | Set
 
 
+@dataclass
+class StatsModel:
+    count: int
+    min: Optional[int]
+    max: Optional[int]
+    avg: Optional[float]
+    sum: int
+    histogram: dict[str, int]
+
+
 @dataclass
 class SearchSchemaModel(SimpleModel):
     data: list[Card | Set]
@@ -22,6 +33,9 @@ class SearchSchemaModel(SimpleModel):
     pageSize: int
     count: int
     totalCount: int
+    nextCursor: Optional[str] = None
+    facets: Optional[dict[str, dict[str, int]]] = None
+    stats: Optional[dict[str, StatsModel]] = None
 
 
 @dataclass
@@ -44,6 +58,17 @@ class SearchSetModel(SearchSchemaModel):
     data: list[Set]
 
 
+@dataclass
+class SuggestionModel:
+    id: str
+    name: str
+
+
+@dataclass
+class SuggestModel(SimpleModel):
+    data: list[SuggestionModel]
+
+
 @dataclass
 class StringSetModel(SimpleModel):
     data: list[str]
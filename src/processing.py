@@ -0,0 +1,183 @@
+# everything here runs in the forked index workers and must never reach the VM, so
+# this module does not import lucene, lupyne or any module that does
+import enum
+import itertools
+import re
+from typing import Any
+from typing import Iterable
+from typing import Iterator
+from typing import Mapping
+from typing import MutableMapping
+
+import config
+
+try:
+    # noinspection PyPackageRequirements
+    import ujson as json
+except ImportError:
+    import json
+
+STRING_SET_FIELDS = ("types", "subtypes", "supertype", "rarity")
+
+
+class SchemaFieldType(enum.Flag):
+    GROUP = 0b0001
+    TEXT = 0b0010
+    TEXT_GROUP = TEXT | GROUP
+    NUMERIC = 0b0100
+    NUMERIC_GROUP = NUMERIC | GROUP
+    NUMERIC_LIKE = 0b1000
+    NUMERIC_LIKE_GROUP = NUMERIC_LIKE | GROUP
+    RAW = 0b10000
+
+
+class ResourceProcessor:
+    FIELD_RAW = "_raw_"
+    FIELD_SOURCE = "_source_"
+
+    _SEPARATOR = "."
+    _SEPARATOR_ESCAPED = re.escape(_SEPARATOR)
+    _RAW_PREFIX = FIELD_RAW + _SEPARATOR
+
+    get_raw_field = (_RAW_PREFIX + "{}").format
+
+    @classmethod
+    def is_raw_field(cls, field: str) -> bool:
+        return field == cls.FIELD_RAW or field.startswith(cls._RAW_PREFIX)
+
+    @staticmethod
+    def is_numeric(string: str) -> bool:
+        try:
+            int(string)
+        except ValueError:
+            return False
+        else:
+            return True
+
+    @classmethod
+    def _flatten(cls, obj, root: MutableMapping[str, Any], __parent: str = "") -> Any:
+        if isinstance(obj, (str, int, float, bool)):
+            return obj
+        elif isinstance(obj, Iterable):
+            if __parent:
+                __parent += cls._SEPARATOR
+            for key, val in obj.items() if isinstance(obj, dict) else enumerate(obj):
+                parent = f"{__parent}{key}"
+                children = {}
+                flattened = cls._flatten(val, children, parent)
+                if flattened is children:
+                    root.update(children)
+                else:
+                    root[parent] = flattened
+            return root
+
+    @classmethod
+    def _merge(cls, obj: Mapping[str, Any]) -> dict[str, Any]:
+        merged = {}
+        non_digit_keys = set()
+        for key in obj.keys():
+            parts = key.split(cls._SEPARATOR)
+            non_digit_parts = [
+                part for part in key.split(cls._SEPARATOR) if not part.isdigit()
+            ]
+            non_digit_key = cls._SEPARATOR.join(non_digit_parts)
+            if parts == non_digit_parts:
+                merged[key] = obj[key]
+            elif non_digit_key not in non_digit_keys:
+                pattern = re.compile(
+                    rf"{cls._SEPARATOR_ESCAPED}\d+{cls._SEPARATOR_ESCAPED}".join(
+                        map(re.escape, non_digit_parts)
+                    )
+                    + rf"(?:{cls._SEPARATOR_ESCAPED}\d+)?"
+                )
+                merged[non_digit_key] = [
+                    val for key_, val in obj.items() if pattern.fullmatch(key_)
+                ]
+                non_digit_keys.add(non_digit_key)
+        return merged
+
+    @classmethod
+    def process(cls, items: Mapping[str, Any]) -> dict[str, Any]:
+        processed = cls._merge(cls._flatten(items, {}))
+        processed[cls.FIELD_RAW] = json.dumps(items, separators=(",", ":"))
+        for key, val in items.items():
+            processed[cls.get_raw_field(key)] = json.dumps(val, separators=(",", ":"))
+        return processed
+
+
+class SchemaInference(dict):
+    def add(self, items: Mapping[str, Any]):
+        for name, texts in items.items():
+            if ResourceProcessor.is_raw_field(name):
+                self[name] = SchemaFieldType.RAW
+                continue
+            field_type = self.get(name, SchemaFieldType.TEXT)
+            # process() leaves lists for groups and scalars for everything else
+            group = isinstance(texts, list)
+            if not group:
+                texts = (texts,)
+            if texts:
+                if isinstance(texts[0], int):
+                    field_type = SchemaFieldType.NUMERIC
+                elif SchemaFieldType.NUMERIC_LIKE not in field_type:
+                    is_numeric = map(ResourceProcessor.is_numeric, texts)
+                    if SchemaFieldType.NUMERIC in field_type:
+                        if not all(is_numeric):
+                            field_type = SchemaFieldType.NUMERIC_LIKE
+                    elif any(is_numeric):
+                        field_type = SchemaFieldType.NUMERIC_LIKE
+            if group:
+                field_type |= SchemaFieldType.GROUP
+            self[name] = field_type
+
+    def merge(self, other: Mapping[str, SchemaFieldType]):
+        for name, field_type in other.items():
+            try:
+                current = self[name]
+            except KeyError:
+                self[name] = field_type
+                continue
+            kind = current & ~SchemaFieldType.GROUP
+            if kind != field_type & ~SchemaFieldType.GROUP:
+                kind = SchemaFieldType.NUMERIC_LIKE
+            self[name] = kind | ((current | field_type) & SchemaFieldType.GROUP)
+
+
+def iter_batches(documents: Iterable[dict]) -> Iterator[list[dict]]:
+    iterator = iter(documents)
+    while batch := list(itertools.islice(iterator, config.INDEX_BATCH_SIZE)):
+        yield batch
+
+
+def read_cards(path: str, set_: dict) -> list[dict]:
+    with open(path, "rb") as file:
+        cards = json.load(file)
+    for card in cards:
+        card["set"] = set_
+    return cards
+
+
+def scan_cards(
+    path: str, set_: dict
+) -> tuple[SchemaInference, dict[str, set[str]], int]:
+    schema = SchemaInference()
+    string_sets = {field: set() for field in STRING_SET_FIELDS}
+    cards = read_cards(path, set_)
+    for card in cards:
+        for field, string_set in string_sets.items():
+            if field in card:
+                value = card[field]
+                string_set.update(value if isinstance(value, list) else (value,))
+        schema.add(ResourceProcessor.process(card))
+    return schema, string_sets, len(cards)
+
+
+def process_cards(
+    path: str, set_: dict, source: str, offset: int, size: int
+) -> list[dict]:
+    documents = []
+    for card in read_cards(path, set_)[offset : offset + size]:
+        document = ResourceProcessor.process(card)
+        document[ResourceProcessor.FIELD_SOURCE] = source
+        documents.append(document)
+    return documents
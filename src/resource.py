@@ -1,13 +1,22 @@
 from __future__ import annotations
 
-import functools
 import os.path
+import shutil
+import time
 import urllib.parse
 from typing import Iterable, Optional, Iterator, Any
 from typing import Mapping
-from typing import MutableMapping
 
-from lupyne.engine.documents import Hit
+from java.io import File
+from lupyne.engine.documents import Hits
+from org.apache.lucene.index import MultiDocValues
+from org.apache.lucene.search import DocIdSetIterator
+from org.apache.lucene.search import ScoreDoc
+from org.apache.lucene.search.suggest import Lookup
+from org.apache.lucene.search.suggest.analyzing import AnalyzingInfixSuggester
+from org.apache.lucene.store import FSDirectory
+from org.apache.lucene.store import MMapDirectory
+from org.apache.lucene.util import BytesRef
 
 from base import ResourceIndexer
 from common import json
@@ -19,7 +28,10 @@ from schema import SchemaFieldType
 class SimpleResource:
     def __init__(self, path: str):
         self._path = path
-        if os.path.exists(path):
+        self.reload()
+
+    def reload(self):
+        if os.path.exists(self._path):
             self.load()
 
     def dump(self):
@@ -54,6 +66,7 @@ class SchemaBuilderResource(SimpleResource, SchemaBuilder):
 
 class SchemaResource(ResourceIndexer):
     RESOURCE: str
+    SUGGEST_WEIGHT_FIELD = "releaseDate"
 
     _IMAGE_URL_BASE = "https://images.pokemontcg.io/"
 
@@ -63,26 +76,62 @@ class SchemaResource(ResourceIndexer):
         mode: str = "r",
         *,
         search_count: Optional[int] = None,
+        search_min_count: Optional[int] = None,
         search_timeout: Optional[int] = None,
         image_url_base: Optional[str] = None,
+        document_cache_size: Optional[int] = None,
+        result_cache_size: Optional[int] = None,
+        result_cache_bytes: Optional[int] = None,
+        query_cache_size: Optional[int] = None,
+        **attrs,
     ):
+        self._suggest_path = os.path.join(directory, "suggest", self.RESOURCE)
+        self._suggester = None, None
         directory = os.path.join(directory, self.RESOURCE)
-        super().__init__(directory, mode)
-        self.indexSearcher.search = functools.partial(
-            self.indexSearcher.search, count=search_count, timeout=search_timeout
+        start = time.perf_counter()
+        super().__init__(
+            directory,
+            mode,
+            document_cache_size=document_cache_size,
+            result_cache_size=result_cache_size,
+            result_cache_bytes=result_cache_bytes,
+            query_cache_size=query_cache_size,
+            **attrs,
         )
+        timings = {"reader": time.perf_counter() - start}
+        self.read_only = mode == "r"
+        self.search_count = search_count
+        self.search_min_count = search_min_count
+        self.search_timeout = search_timeout
         self.image_url_base = image_url_base
+        self._image_url_base_replacements = ()
+        if image_url_base is not None:
+            self._image_url_base_replacements = self._get_image_url_base_replacements(
+                image_url_base
+            )
+        start = time.perf_counter()
         self.schema_builder = SchemaBuilderResource(
             os.path.join(directory, "schema.json")
         )
         self.commit_schema()
-
-    def _replace_image_base_url(self, images: MutableMapping[str, str]):
+        timings["schema"] = time.perf_counter() - start
+        start = time.perf_counter()
+        self._indices_path = os.path.join(directory, "indices.json")
+        if mode == "r":
+            self.load_indices()
+            self.open_suggester()
+        timings["tables"] = time.perf_counter() - start
+        logger.info("%s%s", type(self).__name__, timings)
+
+    def _replace_image_base_url(self, images: Mapping[str, str]) -> Mapping[str, str]:
         if any(url.startswith(self._IMAGE_URL_BASE) for url in images.values()):
-            for image, url in images.items():
-                images[image] = urllib.parse.urljoin(
+            images = {
+                image: urllib.parse.urljoin(
                     self.image_url_base, url.removeprefix(self._IMAGE_URL_BASE)
                 )
+                for image, url in images.items()
+            }
+        return images
 
     def _replace_image_base_urls(self, obj: Mapping[str, Any]) -> Mapping[str, Any]:
         try:
@@ -90,33 +139,185 @@ class SchemaResource(ResourceIndexer):
         except KeyError:
             pass
         else:
-            self._replace_image_base_url(images)
+            obj = {**obj, "images": self._replace_image_base_url(images)}
         return obj
 
+    @classmethod
+    def _get_image_url_base_replacements(
+        cls, image_url_base: str
+    ) -> tuple[tuple[str, str], ...]:
+        old = '"' + cls._IMAGE_URL_BASE
+        new = '"' + urllib.parse.urljoin(image_url_base, "_").removesuffix("_")
+        return (old, new), (old.replace("/", r"\/"), new.replace("/", r"\/"))
+
+    def _replace_image_base_urls_raw(self, obj: str) -> str:
+        for old, new in self._image_url_base_replacements:
+            obj = obj.replace(old, new)
+        return obj
+
+    def search(
+        self,
+        query: Optional[str] = None,
+        sort: Optional[str | Iterable[str]] = None,
+        count: Optional[int] = None,
+        mincount: Optional[int] = None,
+        timeout: Optional[int] = None,
+        after: Optional[ScoreDoc] = None,
+    ) -> Hits:
+        if self.search_count is not None:
+            count = (
+                self.search_count if count is None else min(count, self.search_count)
+            )
+        if mincount is None:
+            mincount = self.search_min_count
+        if timeout is None:
+            timeout = self.search_timeout
+        return super().search(query, sort, count, mincount, timeout, after)
+
     def iter_hits(
         self,
-        hits: Iterable[Hit],
+        hits: Hits,
         select: Optional[str | Iterable[str]] = None,
         start: int = 0,
         stop: Optional[int] = None,
-    ) -> Iterator[dict[str, Any]]:
+    ) -> Iterator[Mapping[str, Any]]:
         hits = super().iter_hits(hits, select, start, stop)
         if self.image_url_base is not None:
             hits = map(self._replace_image_base_urls, hits)
         return hits
 
+    def iter_raw_hits(
+        self,
+        hits: Hits,
+        select: Optional[str | Iterable[str]] = None,
+        start: int = 0,
+        stop: Optional[int] = None,
+    ) -> Iterator[str]:
+        hits = super().iter_raw_hits(hits, select, start, stop)
+        if self.image_url_base is not None:
+            hits = map(self._replace_image_base_urls_raw, hits)
+        return hits
+
+    def reopen(self) -> bool:
+        if not super().reopen():
+            return False
+        self.schema_builder.reload()
+        self.commit_schema()
+        self.load_indices()
+        self.open_suggester()
+        return True
+
+    def dump_indices(self):
+        searcher = self.indexSearcher
+        ids = [None] * searcher.maxDoc()
+        for id_, index in self.get_indices(searcher).items():
+            ids[index] = id_
+        obj = {"generation": searcher.version, "ids": ids}
+        logger.debug("dump_indices%s", {"path": self._indices_path})
+        with open(self._indices_path, "w") as file:
+            json.dump(obj, file, separators=(",", ":"))
+
+    def load_indices(self) -> bool:
+        if not os.path.exists(self._indices_path):
+            return False
+        with open(self._indices_path, "r") as file:
+            obj = json.load(file)
+        searcher = self.indexSearcher
+        if obj["generation"] != searcher.version:
+            logger.debug("load_indices%s", {"generation": obj["generation"]})
+            return False
+        indices = {
+            id_: index for index, id_ in enumerate(obj["ids"]) if id_ is not None
+        }
+        self.set_indices(searcher, indices)
+        return True
+
+    @staticmethod
+    def _get_date_weight(date: Optional[str]) -> int:
+        digits = "".join(filter(str.isdigit, date or ""))
+        return int(digits) if digits else 0
+
+    def _iter_suggestions(self) -> Iterator[tuple[str, str, int]]:
+        searcher = self.indexSearcher
+        names = MultiDocValues.getSortedValues(searcher.indexReader, self.FIELD_DEFAULT)
+        ids = MultiDocValues.getSortedValues(searcher.indexReader, self.FIELD_STORED)
+        if names is None or ids is None:
+            return
+        weights = MultiDocValues.getSortedValues(
+            searcher.indexReader, self.SUGGEST_WEIGHT_FIELD
+        )
+        bits = searcher.bits
+        for index in iter(names.nextDoc, DocIdSetIterator.NO_MORE_DOCS):
+            if bits and not bits.get(index):
+                continue
+            if not ids.advanceExact(index):
+                continue
+            weight = 0
+            if weights is not None and weights.advanceExact(index):
+                weight = self._get_date_weight(
+                    weights.lookupOrd(weights.ordValue()).utf8ToString()
+                )
+            yield (
+                ids.lookupOrd(ids.ordValue()).utf8ToString(),
+                names.lookupOrd(names.ordValue()).utf8ToString(),
+                weight,
+            )
+
+    def dump_suggester(self):
+        # the suggester's writer appends to an existing index, so start afresh
+        shutil.rmtree(self._suggest_path, ignore_errors=True)
+        suggester = AnalyzingInfixSuggester(
+            FSDirectory.open(File(self._suggest_path).toPath()), self.analyzer
+        )
+        try:
+            count = 0
+            for id_, name, weight in self._iter_suggestions():
+                suggester.add(BytesRef(name), None, weight, BytesRef(id_))
+                count += 1
+            if count:
+                suggester.commit()
+            logger.info(f"{self.RESOURCE}: suggestions={count}")
+        finally:
+            suggester.close()
+
+    def open_suggester(self) -> bool:
+        if not os.path.exists(self._suggest_path):
+            return False
+        searcher = self.indexSearcher
+        suggester = AnalyzingInfixSuggester(
+            MMapDirectory(File(self._suggest_path).toPath()), self.analyzer
+        )
+        # closed with the searcher generation it was opened for, which suggest()
+        # holds on to, so a reload never closes it under a running lookup
+        searcher.shared.add(suggester)
+        self._suggester = searcher, suggester
+        return True
+
+    def suggest(self, prefix: str, count: int) -> list[dict[str, str]]:
+        searcher, suggester = self._suggester
+        if suggester is None or not prefix.strip():
+            return []
+        results = suggester.lookup(prefix, count, True, False)
+        return [
+            {"id": result.payload.utf8ToString(), "name": result.key.toString()}
+            for result in map(Lookup.LookupResult.cast_, results)
+        ]
+
     def add_schema(self, items: Mapping[str, Any]):
         self.schema_builder.add(items)
 
     def commit_schema(self):
-        self.schema_builder.commit(self)
+        self.schema_builder.commit(
+            self, self.indexSearcher.fieldinfos if self.read_only else None
+        )
 
 
 class CardResource(SchemaResource):
     RESOURCE = "card"
+    SUGGEST_WEIGHT_FIELD = "set.releaseDate"
 
     def _replace_image_base_urls(self, obj: Mapping[str, Any]) -> Mapping[str, Any]:
-        super()._replace_image_base_urls(obj)
+        obj = super()._replace_image_base_urls(obj)
         try:
             set_ = obj["set"]
         except KeyError:
@@ -127,7 +328,8 @@ class CardResource(SchemaResource):
             except KeyError:
                 pass
             else:
-                self._replace_image_base_url(images)
+                set_ = {**set_, "images": self._replace_image_base_url(images)}
+                obj = {**obj, "set": set_}
         return obj
 
 
@@ -149,6 +351,20 @@ class StringSetResource(SimpleResource, set[str]):
         self.update(state)
 
 
+class SourceResource(SimpleResource, dict[str, str]):
+    RESOURCE = "source"
+
+    def __init__(self, directory: str):
+        super().__init__(os.path.join(directory, self.RESOURCE + ".json"))
+
+    def get_state(self) -> dict[str, str]:
+        return dict(sorted(self.items()))
+
+    def set_state(self, state: Mapping[str, str]):
+        self.clear()
+        self.update(state)
+
+
 class TypeResource(StringSetResource):
     RESOURCE = "type"
 
@@ -0,0 +1,63 @@
+import concurrent.futures
+import contextvars
+import threading
+import time
+from typing import Any
+from typing import Callable
+
+import exception
+import metrics
+from common import attach_current_thread
+
+
+class WorkerPool:
+    def __init__(self, max_workers: int, max_pending: int):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers,
+            thread_name_prefix="lucene",
+            initializer=attach_current_thread,
+        )
+        self._lock = threading.Lock()
+
+    def _done(self, _: concurrent.futures.Future):
+        with self._lock:
+            self.pending -= 1
+
+    @staticmethod
+    def _run(submitted: float, fn: Callable, *args) -> Any:
+        metrics.add_phase("queue", time.perf_counter() - submitted)
+        return fn(*args)
+
+    def submit(self, fn: Callable, *args) -> concurrent.futures.Future:
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise exception.ServiceUnavailableException
+            self.pending += 1
+        try:
+            future = self._executor.submit(
+                contextvars.copy_context().run,
+                self._run,
+                time.perf_counter(),
+                fn,
+                *args,
+            )
+        except BaseException:
+            self._done(None)
+            raise
+        future.add_done_callback(self._done)
+        return future
+
+    def shutdown(self):
+        self._executor.shutdown()
+
+    def get_stats(self) -> dict[str, int]:
+        return {
+            "workers": self.max_workers,
+            "pending": self.pending,
+            "rejected": self.rejected,
+        }